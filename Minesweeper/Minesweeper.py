@@ -1,211 +1,153 @@
-import random
+from __future__ import print_function
 
+import engine
+import grid
 
-class Minesweeper:
-    DIFFICULTIES = ['BEGINNER', 'INTERMEDIATE', 'EXPERT']
-    difficulty = ''
-    stack = []
-    stack_index = []
-    num_of_flags = None
-    num_of_bombs = None
-    x_range = None
-    y_range = None
-    tiles_remaining = None
-    game_over = False
-    win = False
-
-    def __init__(self, difficulty):
-        try:
-            self.difficulty = self.DIFFICULTIES[difficulty-1]
-        except IndexError:
-            print('Invalid difficulty. Must be between 1 and 3')
-
-        self.fill_stack()
-
-
-
-    def fill_stack(self):
-        """
-        Generates the stack with coordinate lists based on difficulty
-        Beginner = 8x8
-        Intermediate = 16x16
-        Expert = 16x31
-        :param difficulty: can be 'Beginner', 'Intermediate', or 'Expert'
-
-        """
-
-        if self.difficulty=='BEGINNER':
-            self.x_range = 8
-            self.y_range = 8
-            self.num_of_bombs = 10
-            self.num_of_flags = self.num_of_bombs
-            self.tiles_remaining = (self.x_range*self.y_range)
-
-            for i in range(self.x_range):
-                for j in range(8):
-                    self.stack.append([(i, j), 0, False])
-            self.generate_stack_index()
-
-        elif self.difficulty=='INTERMEDIATE':
-            self.x_range = 16
-            self.y_range = 16
-            self.num_of_bombs = 40
-            self.num_of_flags = self.num_of_bombs
-            self.tiles_remaining = (self.x_range*self.y_range)-self.num_of_bombs
-
-            for i in range(self.x_range):
-                for j in range(self.y_range):
-                    self.stack.append([(i, j), 0, False])
-            self.generate_stack_index()
-
-        elif self.difficulty == 'EXPERT':
-            self.x_range = 16
-            self.y_range = 31
-            self.num_of_bombs = 99
-            self.num_of_flags = self.num_of_bombs
-            self.tiles_remaining = (self.x_range*self.y_range)-self.num_of_bombs
-
-            for i in range(self.x_range):
-                for j in range(self.y_range):
-                    self.stack.append([(i, j), 0, False])
-            self.generate_stack_index()
-
-        else:
-            raise ValueError('Invalid difficulty')
 
+class Minesweeper(object):
+    """A standalone game for offline play and simulation. All state lives
+    in __slots__: the engine's packed board plus any '?' marks, so a game
+    takes a fixed amount of memory and thousands can share a process.
+    stack and stack_index are built from the board when read."""
+    __slots__ = ('difficulty', 'engine', 'marks')
 
-    def add_bombs(self, protected_tile):
-        count = self.num_of_bombs
+    DIFFICULTIES = ['BEGINNER', 'INTERMEDIATE', 'EXPERT']
 
-        while count > 0:
-            index = random.randint(0, len(self.stack)-1)
-            if self.stack[index][1] != '#' or index != protected_tile:
-                self.stack[index][1] = '#'
-                count -= 1
-                bomb_list.append(index)
-        self.add_bomb_proximities(bomb_list)
+    def __init__(self, difficulty, seed=None):
+        if difficulty not in engine.BOARD_SIZES:
+            raise ValueError('Invalid difficulty. Must be between 1 and 3')
+        self.difficulty = self.DIFFICULTIES[difficulty-1]
+        x_range, y_range, num_of_bombs = engine.BOARD_SIZES[difficulty]
+        self.engine = engine.Engine(x_range, y_range, num_of_bombs, seed=seed)
+        # Tiles marked '?', created on the first mark
+        self.marks = None
+
+    @property
+    def x_range(self):
+        return self.engine.x_range
+
+    @property
+    def y_range(self):
+        return self.engine.y_range
+
+    @property
+    def num_of_bombs(self):
+        return self.engine.num_of_bombs
+
+    @property
+    def num_of_flags(self):
+        return self.engine.flags_remaining
+
+    @property
+    def tiles_remaining(self):
+        return self.engine.tiles_remaining
+
+    @property
+    def game_over(self):
+        return self.engine.game_over
+
+    @property
+    def win(self):
+        return self.engine.win
+
+    @property
+    def stack(self):
+        """A fresh [coordinate, value, state] list per tile: value is '#'
+        for a mine, state is True once flipped, 'F' when flagged, '?' when
+        marked and False otherwise. Changing it does not change the game"""
+        stack = []
+        for i, byte in enumerate(self.engine.tiles):
+            value = byte & grid.VALUE_MASK
+            if byte & grid.FLIPPED:
+                state = True
+            elif byte & grid.FLAGGED:
+                state = 'F'
+            else:
+                state = '?' if self.marks and i in self.marks else False
+            stack.append([grid.coordinate(i, self.y_range),
+                          '#' if value == grid.MINE else value, state])
+        return stack
 
+    @property
+    def stack_index(self):
+        """:Returns: the coordinate of every tile, in index order"""
+        return [grid.coordinate(i, self.y_range)
+                for i in range(self.x_range*self.y_range)]
 
-    def generate_stack_index(self):
-        """indexes the coordinates so their index is searchable"""
-        for i in range(len(self.stack)):
-            self.stack_index.append(self.stack[i][0])
+    def add_bombs(self, protected_tile):
+        """Lays the mines out from the seed, keeping protected_tile clear"""
+        self.engine.arm(protected_tile)
 
     def find_connecting_indexes(self, index):
         """:Returns: a list of all adjacent indexes to a given index"""
-        nodes = []
-        x = self.stack_index[index][0]
-        y = self.stack_index[index][1]
-
-        for i in range(x-1, x+2):
-            for j in range(y-1, y+2):
-                if (i == x and j == y):
-                    continue
-                else:
-                    try:
-                        ad_index = self.stack_index.index((i,j))
-                        nodes.append(ad_index)
-                    except:
-                        continue
-        return nodes
-
-
-
-    def add_bomb_proximities(self, mine_list):
-        """surrounds bombs with proximity numbers"""
-
-        for mine in mine_list:
-            nodes = self.find_connecting_indexes(mine)
-            for node in nodes:
-                value = self.stack[node][1]
-                if value == '#':
-                    continue
-                else:
-                    self.stack[node][1] += 1
+        return list(grid.neighbors(index, self.x_range, self.y_range))
 
     def flip_tile(self, tile, flag=None):
-        #tile_index = self.stack_index.index(tile)
-        tile_value = self.stack[tile][1]
-
-        if self.stack[tile][2]:
-            if flag == 'F':
-                if self.num_of_flags == 0:
-                    raise ValueError
-                else:
-                    self.stack[tile][2] = 'F'
-                    self.num_of_flags -= 1
-
-            elif flag == '?':
-                self.stack[tile][2] = '?'
-
+        """Flips tile, or marks it: flag 'F' flags it and '?' marks it as a
+        guess. The first flip lays the mines out around the tile.
+        :Returns: the indexes of every tile the move changed"""
+        if flag == '?':
+            if self.engine.tiles[tile] & (grid.FLIPPED | grid.FLAGGED):
+                return []
+            if self.marks is None:
+                self.marks = set()
+            self.marks.add(tile)
+            return [tile]
+        if flag == 'F':
+            changed = self.engine.flag(tile)
         else:
-            self.stack[tile][2] = True
-            self.tiles_remaining -= 1
-            if tile_value == '#':
-                self.game_over = True
-            elif tile_value == 0:
-                #pass
-                self.blank_tile_cascade(tile)
-            self.check_win()
-
-
-
-    def blank_tile_cascade(self, tile):
-        """Checks all surrounding nodes for 0 value, and flips them.
-        Recursively checks each new empty node.
-        """
-        nodes = self.find_connecting_indexes(tile)
-        for node in nodes:
-            if self.stack[node][1] != 0:
-                self.stack[node][2] = True
-                continue
-            else:
-                if not self.stack[node][2]:
-                    self.stack[node][2] = True
-                    self.tiles_remaining -= 1
-                    self.blank_tile_cascade(node)
-
-
-    def check_win(self):
-        if self.tiles_remaining == self.num_of_bombs:
-            self.game_over = True
-            self.win = True
-
+            changed = self.engine.reveal(tile)
+        self._clear_marks(changed)
+        return changed
+
+    def chord(self, tile):
+        """Flips the unflagged neighbors of a number whose mines are all
+        flagged (see engine.Engine.chord)
+        :Returns: the indexes of every tile the move changed"""
+        changed = self.engine.chord(tile)
+        self._clear_marks(changed)
+        return changed
+
+    def _clear_marks(self, changed):
+        if self.marks:
+            self.marks.difference_update(changed)
 
     def print_stack(self):
         for i in self.stack:
             print(i)
 
     def print_stack_index(self):
-        for i in range(len(self.stack_index)):
-            print("{0}: {1}").format(i, self.stack_index[i])
+        for i, coordinate in enumerate(self.stack_index):
+            print("{0}: {1}".format(i, coordinate))
 
     def print_grid(self):
+        stack = self.stack
         index = 0
         for i in range(self.x_range):
             line = ""
             for j in range(self.y_range):
-                if not self.stack[index][2]:
+                if not stack[index][2]:
                     line += "| "
-                elif self.stack[index][2] == 'F':
+                elif stack[index][2] == 'F':
                     line += "|F"
-                elif self.stack[index][2] == '?':
+                elif stack[index][2] == '?':
                     line += "|?"
                 else:
-                    line += "|{}".format(self.stack[index][1])
+                    line += "|{}".format(stack[index][1])
                 index += 1
             line += '|'
-            print line
+            print(line)
 
     def print_exposed_grid(self):
+        stack = self.stack
         index = 0
         for i in range(self.x_range):
             line = ""
             for j in range(self.y_range):
-                line += "|{}".format(self.stack[index][1])
+                line += "|{}".format(stack[index][1])
                 index += 1
             line += '|'
-            print line
+            print(line)
 
     def get_difficulty(self):
         return self.difficulty
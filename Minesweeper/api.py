@@ -5,28 +5,77 @@ primarily with communication to/from the API's users."""
 
 
 import logging
+import time
 import endpoints
-from datetime import date
 
 from protorpc import remote, messages
 from google.appengine.api import memcache
+from google.appengine.api import oauth
 from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 
-from models import User, Game, Score
+import board_pool
+import counters
+import instrument
+from models import User, Game, Score, BOARD_FORMATS, BOARD_SIZES,\
+    RANKINGS_PAGE_SIZE, user_names
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
-    ScoreForms, GameForms, UserForm, UserForms
-from utils import get_by_urlsafe
+    MakeMovesForm, BoardChunkForm, MoveResultForm, MoveForms, ScoreForms,\
+    GameForms, UserForm, UserForms, GameStatsForm, GameStatsForms,\
+    InstrumentStatForm, InstrumentStatForms
+from utils import get_cursor
+import game_session
+from game_session import GameSession
+
+DEFAULT_PAGE_SIZE = RANKINGS_PAGE_SIZE
+MAX_PAGE_SIZE = 100
+MAX_MOVES_PER_REQUEST = 100
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
         urlsafe_game_key=messages.StringField(1),)
+GET_BOARD_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        board_format=messages.StringField(2, default='repr'),)
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1),)
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
+USER_GAMES_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    board_format=messages.StringField(2, default='repr'),
+    page_size=messages.IntegerField(3, default=DEFAULT_PAGE_SIZE),
+    cursor=messages.StringField(4),)
+USER_PAGE_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2, default=DEFAULT_PAGE_SIZE),
+    cursor=messages.StringField(3),)
+GAME_PAGE_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    page_size=messages.IntegerField(2, default=DEFAULT_PAGE_SIZE),
+    cursor=messages.StringField(3),)
+BOARD_CHUNK_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    chunk=messages.IntegerField(2, required=True),)
+INSTRUMENT_REQUEST = endpoints.ResourceContainer(
+    sample_rate=messages.FloatField(1, required=True),
+    reset=messages.BooleanField(2, default=False),)
+REPLAY_REQUEST = endpoints.ResourceContainer(
+    urlsafe_game_key=messages.StringField(1),
+    move_number=messages.IntegerField(2, required=True),
+    board_format=messages.StringField(3, default='repr'),)
+PAGE_REQUEST = endpoints.ResourceContainer(
+    page_size=messages.IntegerField(1, default=DEFAULT_PAGE_SIZE),
+    cursor=messages.StringField(2),)
 
 MEMCACHE_TILES_REMAINING = 'TILES_REMAINING'
+# Games started or finished within one window share a single recache task
+AVERAGE_TILES_SECONDS = 60
+RECOUNT_BATCH_SIZE = 500
 
 @endpoints.api(name='minesweeper', version='v1')
 class MineSweeperApi(remote.Service):
@@ -36,6 +85,7 @@ class MineSweeperApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrument.traced('MineSweeperApi.create_user')
     def create_user(self, request):
         """Create a User. Requires a unique username"""
         if User.query(User.name == request.user_name).get():
@@ -46,36 +96,65 @@ class MineSweeperApi(remote.Service):
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
-    @endpoints.method(response_message=UserForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=UserForms,
                       path='user/ranking',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_user_rankings')
     def get_user_rankings(self, request):
-        """Return all Users ranked by their win percentage"""
-        users = User.query(User.total_played > 0).fetch()
-        users = sorted(users, key=lambda x: x.win_percentage, reverse=True)
-        return UserForms(items=[user.to_form() for user in users])
+        """Return Users who have played ranked by their win percentage, a
+        page at a time. The first page is served from memcache"""
+        if not request.cursor and request.page_size == RANKINGS_PAGE_SIZE:
+            users, next_cursor = User.top_ranked()
+        else:
+            users, next_cursor = User.ranked_page(
+                self._page_size(request), get_cursor(request.cursor))
+        return UserForms(items=[user.to_form() for user in users],
+                         next_cursor=next_cursor)
 
     @endpoints.method(request_message=NEW_GAME_REQUEST,
                       response_message=GameForm,
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrument.traced('MineSweeperApi.new_game')
     def new_game(self, request):
         """Creates new game"""
         user = User.query(User.name == request.user_name).get()
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        try:
-            game = Game.new_game(user.key, request.difficulty)
-        except ValueError:
+        custom = (request.width, request.height, request.mines)
+        if any(value is not None for value in custom):
+            if None in custom:
+                raise endpoints.BadRequestException(
+                        'width, height and mines must be given together')
+            size = (request.height, request.width, request.mines)
+            layout = None
+        elif request.difficulty not in BOARD_SIZES:
             raise endpoints.BadRequestException('Difficulty must be between '
                                                     '1 and 3')
+        else:
+            size = None
+            # Start from a ready-made layout when the pool has one; the
+            # first move only has to shift any mine off the tile it flips.
+            layout = board_pool.claim(request.difficulty)
+        try:
+            game = Game.new_game(user.key, request.difficulty, layout,
+                                 user.name, size)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        GameSession.start(game)
+        counters.increment({
+            counters.difficulty_counter(counters.GAMES_STARTED,
+                                        game.difficulty): 1,
+            counters.ACTIVE_GAMES: 1,
+            counters.ACTIVE_TILES_REMAINING: game.counted_tiles})
         # Use a task queue to update the average attempts remaining.
         # This operation is not needed to complete the creation of a new game
         # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_tiles')
+        self._queue_average_tiles()
         return game.to_form('Good luck playing Minesweeper!')
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -83,11 +162,20 @@ class MineSweeperApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrument.traced('MineSweeperApi.cancel_game')
     def cancel_game(self, request):
-        """Deletes an unfinished game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        """Deletes an unfinished game with everything stored under it: its
+        MoveLog pages, MoveJournal and BoardChunks"""
+        session = GameSession.load(request.urlsafe_game_key)
+        game = session and session.game
         if game and not game.game_over:
-            game.key.delete()
+            deltas = game.active_count_deltas(removed=True)
+            ndb.delete_multi(ndb.Query(ancestor=game.key).fetch(
+                keys_only=True))
+            game_session.discard(request.urlsafe_game_key)
+            if deltas:
+                counters.increment(deltas)
+                self._queue_average_tiles()
             return StringMessage(message='Game with key: {} deleted.'.
                                     format(request.urlsafe_game_key))
         elif game and game.game_over:
@@ -95,133 +183,397 @@ class MineSweeperApi(remote.Service):
         else:
             raise endpoints.NotFoundException('Game not found!')
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=GET_BOARD_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_game')
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            return game.to_form('Time to make a move!')
+        session = GameSession.load(request.urlsafe_game_key)
+        if session:
+            game = session.game
+            try:
+                return game.to_form('Time to make a move!',
+                                    request.board_format)
+            except ValueError:
+                raise endpoints.BadRequestException(
+                        'board_format must be one of repr, packed or ints')
         else:
             raise endpoints.NotFoundException('Game not found!')
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
-                      response_message=StringMessage,
+    @endpoints.method(request_message=BOARD_CHUNK_REQUEST,
+                      response_message=BoardChunkForm,
+                      path='game/{urlsafe_game_key}/chunk/{chunk}',
+                      name='get_board_chunk',
+                      http_method='GET')
+    @instrument.traced('MineSweeperApi.get_board_chunk')
+    def get_board_chunk(self, request):
+        """Returns one chunk of a chunked game's board, which get_game
+        leaves out"""
+        session = GameSession.load(request.urlsafe_game_key)
+        if not session:
+            raise endpoints.NotFoundException('Game not found!')
+        try:
+            return session.game.chunk_form(request.chunk)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+    @endpoints.method(request_message=GAME_PAGE_REQUEST,
+                      response_message=MoveForms,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_game_history')
     def get_game_history(self, request):
-        """Returns a move history for a game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if not game:
+        """Returns a game's moves in the order they were made, a page at a
+        time. The cursor is the number of the next move"""
+        session = GameSession.load(request.urlsafe_game_key)
+        if not session:
             raise endpoints.NotFoundException('Game not found')
-        return StringMessage(message=str(game.history))
+        game = session.game
+        try:
+            start = max(int(request.cursor or 0), 0)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid cursor')
+        stop = start + self._page_size(request)
+        records = game.read_moves(start, stop)
+        return MoveForms(items=game.to_move_forms(start, records),
+                         next_cursor=str(stop) if stop < game.move_count
+                         else None)
 
-    @endpoints.method(request_message=MAKE_MOVE_REQUEST,
+    @endpoints.method(request_message=REPLAY_REQUEST,
                       response_message=GameForm,
+                      path='game/{urlsafe_game_key}/replay',
+                      name='replay_game',
+                      http_method='GET')
+    @instrument.traced('MineSweeperApi.replay_game')
+    def replay_game(self, request):
+        """Returns the game as it stood after its first move_number moves,
+        rebuilt from its seed, move log and snapshots"""
+        session = GameSession.load(request.urlsafe_game_key)
+        if not session:
+            raise endpoints.NotFoundException('Game not found!')
+        try:
+            game = session.game.replay(request.move_number)
+            return game.to_form('Replayed {} moves'.format(game.move_count),
+                                request.board_format)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+    @endpoints.method(request_message=MAKE_MOVE_REQUEST,
+                      response_message=MoveResultForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrument.traced('MineSweeperApi.make_move')
     def make_move(self, request):
-        """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        user = User.query(User.name==game.user).get()
-        msg = ''
-        if game.game_over:
-            return game.to_form('Game already over!')
+        """Makes a move. Returns the tiles it changed with a message. The
+        full board is only sent by get_game"""
+        return self._play_moves(request.urlsafe_game_key, [request])
 
-        if game.first_move == True:
-            game.add_bombs(request.tile)
-            game.flip_tile(request.tile)
-            game.first_move = False
-        else:
-            game.flip_tile(request.tile, request.flag)
-            if game.game_over == True:
-                if game.win == True:
-                    user.add_win()
-                    msg = 'You win!'
-                else:
-                    user.add_loss()
-                    msg = 'You lose!'
-                score = Score(date=date.today(),
-                              user=game.user,
-                              tiles_remaining=game.tiles_remaining,
-                              difficulty=game.difficulty,
-                              won= game.win,)
-                score.put()
-            else:
-                msg = 'Nice move!'
-        game.add_to_game_history(request.tile, request.flag)
-        game.put()
-        return game.to_form(msg)
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MoveResultForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrument.traced('MineSweeperApi.make_moves')
+    def make_moves(self, request):
+        """Makes several moves in order, stopping once the game is over.
+        Returns every tile they changed, with the message of the last move
+        played"""
+        if not request.moves:
+            raise endpoints.BadRequestException('No moves given')
+        if len(request.moves) > MAX_MOVES_PER_REQUEST:
+            raise endpoints.BadRequestException(
+                'At most {} moves per request'.format(MAX_MOVES_PER_REQUEST))
+        return self._play_moves(request.urlsafe_game_key, request.moves)
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_scores')
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return all scores, a page at a time"""
+        scores, next_cursor, more = Score.query().fetch_page(
+            self._page_size(request), start_cursor=get_cursor(request.cursor))
+        names = user_names(scores)
+        return ScoreForms(items=[score.to_form(names.get(score.user))
+                                 for score in scores],
+                          next_cursor=self._next_cursor(next_cursor, more))
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_user_scores')
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
+        """Returns an individual User's scores, a page at a time"""
         user = User.query(User.name == request.user_name).get()
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, next_cursor, more = Score.query(
+            Score.user == user.key).fetch_page(
+                self._page_size(request),
+                start_cursor=get_cursor(request.cursor))
+        return ScoreForms(items=[score.to_form(user.name) for score in scores],
+                          next_cursor=self._next_cursor(next_cursor, more))
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_GAMES_REQUEST,
                       response_message=GameForms,
                       path='user/{user_name}/games',
                       name='get_user_games',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_user_games')
     def get_user_games(self, request):
-        """Return all User's active games"""
+        """Return a User's active games, a page at a time"""
         user = User.query(User.name == request.user_name).get()
         if not user:
             raise endpoints.BadRequestException('User not found!')
-        games = Game.query(Game.user==user.key).filter(Game.game_over == False)
-        return GameForms(items=[game.to_form() for game in games])
+        if request.board_format not in BOARD_FORMATS:
+            raise endpoints.BadRequestException(
+                    'board_format must be one of repr, packed or ints')
+        games, next_cursor, more = Game.query(Game.user==user.key).filter(
+            Game.game_over == False).fetch_page(
+                self._page_size(request),
+                start_cursor=get_cursor(request.cursor))
+        games = game_session.latest(games)
+        return GameForms(items=[game.to_form(board_format=request.board_format,
+                                             user_name=user.name)
+                                for game in games],
+                         next_cursor=self._next_cursor(next_cursor, more))
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_tiles',
                       name='get_average_tiles_remaining',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_average_tiles')
     def get_average_tiles(self, request):
         """Get the cached average moves remaining"""
         return StringMessage(message=memcache.get(MEMCACHE_TILES_REMAINING) or '')
 
+    @endpoints.method(response_message=GameStatsForms,
+                      path='games/stats',
+                      name='get_game_stats',
+                      http_method='GET')
+    @instrument.traced('MineSweeperApi.get_game_stats')
+    def get_game_stats(self, request):
+        """Returns games started, won and lost and the average tiles
+        remaining at the end of a game, for every difficulty"""
+        stats = [counters.GAMES_STARTED, counters.GAMES_WON,
+                 counters.GAMES_LOST, counters.TILES_REMAINING]
+        counts = counters.get_counts(
+            [counters.difficulty_counter(stat, difficulty)
+             for difficulty in BOARD_SIZES for stat in stats])
+        items = []
+        for difficulty in sorted(BOARD_SIZES):
+            started, won, lost, tiles = [
+                counts[counters.difficulty_counter(stat, difficulty)]
+                for stat in stats]
+            form = GameStatsForm(difficulty=difficulty, games_started=started,
+                                 games_won=won, games_lost=lost)
+            if won + lost:
+                form.average_tiles_remaining = float(tiles)/(won + lost)
+            items.append(form)
+        return GameStatsForms(items=items)
+
     @endpoints.method(response_message=ScoreForms,
                       path='games/high_score',
                       name='get_high_score',
                       http_method='GET')
+    @instrument.traced('MineSweeperApi.get_high_score')
     def get_high_score(self, request):
         """Returns the top 10 high scores"""
         scores = Score.query(Score.won == True).order(-Score.difficulty,
                                      Score.tiles_remaining).fetch(limit=10)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        names = user_names(scores)
+        return ScoreForms(items=[score.to_form(names.get(score.user))
+                                 for score in scores])
+
+    @endpoints.method(response_message=InstrumentStatForms,
+                      path='stats/instrument',
+                      name='get_instrument_stats',
+                      http_method='GET')
+    def get_instrument_stats(self, request):
+        """Returns the time, RPCs and bytes per call of each instrumented
+        API and Game method, averaged over the calls sampled so far"""
+        return self._instrument_stats()
+
+    @endpoints.method(request_message=INSTRUMENT_REQUEST,
+                      response_message=InstrumentStatForms,
+                      path='stats/instrument',
+                      name='set_instrument_sampling',
+                      http_method='PUT')
+    def set_instrument_sampling(self, request):
+        """Sets the share of calls instrumented, 0 to turn it off. reset
+        drops the totals gathered so far. Only for administrators of the
+        application"""
+        self._require_admin()
+        try:
+            instrument.set_sample_rate(request.sample_rate)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        if request.reset:
+            instrument.reset_stats()
+        return self._instrument_stats()
+
+    def _play_moves(self, urlsafe_game_key, moves):
+        """Plays MakeMoveForms in order on one load of the game session and
+        stores them with a single save, so a burst of moves costs one
+        compare-and-set and at most one flush. Either every move is stored
+        or none is; moves after the game ends are dropped, and a tile off
+        the board rejects them all before any is played.
+        :Returns: a MoveResultForm listing each changed tile once"""
+        for _ in range(game_session.CAS_RETRIES):
+            session = GameSession.load(urlsafe_game_key)
+            if not session:
+                raise endpoints.NotFoundException('Game not found!')
+            game = session.game
+            msg = ''
+            if game.game_over:
+                return game.to_move_form([], 'Game already over!')
+            if any(not 0 <= move.tile < game.x_range*game.y_range
+                   for move in moves):
+                raise endpoints.BadRequestException('Invalid tile')
+
+            changed = []
+            seen = set()
+            for move in moves:
+                if game.game_over:
+                    break
+                try:
+                    if game.first_move == True:
+                        # The first flip arms the board around the tile
+                        tiles = game.flip_tile(move.tile)
+                        game.add_to_game_history(move.tile)
+                    elif move.chord:
+                        tiles = game.chord(move.tile)
+                        msg = 'Nice move!'
+                        game.add_to_game_history(move.tile, chord=True)
+                    else:
+                        tiles = game.flip_tile(move.tile, move.flag)
+                        msg = 'Nice move!'
+                        game.add_to_game_history(move.tile, move.flag)
+                except ValueError as e:
+                    raise endpoints.BadRequestException(str(e))
+                game.version += 1
+                changed.extend(tile for tile in tiles if tile not in seen)
+                seen.update(tiles)
+            if not game.game_over:
+                saved = session.save()
+            else:
+                # The User and Score go out in one batch, with the
+                # outcome counters alongside, once the game is stored
+                msg = 'You win!' if game.win else 'You lose!'
+                user, score = game.end_game_async().get_result()
+                outcome = (counters.GAMES_WON if game.win
+                           else counters.GAMES_LOST)
+                saved = session.save(also=[user, score], deltas={
+                    counters.difficulty_counter(outcome, game.difficulty): 1,
+                    counters.difficulty_counter(counters.TILES_REMAINING,
+                                                game.difficulty):
+                        game.tiles_remaining})
+            if saved:
+                break
+        else:
+            raise endpoints.ConflictException(
+                    'The game was changed by another move, try again')
+
+        if game.game_over:
+            User.invalidate_rankings(user)
+            self._queue_average_tiles()
+        form = game.to_move_form(changed, msg)
+        session.wait()
+        return form
+
+    @staticmethod
+    def _instrument_stats():
+        """Returns InstrumentStatForms averaging the instrument totals"""
+        items = []
+        for name, totals in sorted(instrument.get_stats().items()):
+            calls = float(totals['calls'])
+            items.append(InstrumentStatForm(
+                name=name, calls=totals['calls'],
+                wall_ms=totals['wall_us'] / calls / 1000,
+                cpu_ms=totals['cpu_us'] / calls / 1000,
+                datastore_rpcs=totals['datastore_rpcs'] / calls,
+                datastore_bytes=totals['datastore_bytes'] / calls,
+                memcache_rpcs=totals['memcache_rpcs'] / calls,
+                memcache_bytes=totals['memcache_bytes'] / calls,
+                response_bytes=totals['response_bytes'] / calls))
+        return InstrumentStatForms(items=items,
+                                   sample_rate=instrument.sample_rate())
+
+    @staticmethod
+    def _require_admin():
+        """Raises UnauthorizedException unless the request is signed in,
+        and ForbiddenException unless it is signed in as an administrator
+        of the application"""
+        if endpoints.get_current_user() is None:
+            raise endpoints.UnauthorizedException('Sign in required')
+        try:
+            admin = oauth.is_current_user_admin(endpoints.EMAIL_SCOPE)
+        except oauth.Error:
+            admin = False
+        if not admin:
+            raise endpoints.ForbiddenException('Administrators only')
+
+    @staticmethod
+    def _page_size(request):
+        """Returns the requested page size, kept between 1 and MAX_PAGE_SIZE"""
+        return min(max(request.page_size, 1), MAX_PAGE_SIZE)
+
+    @staticmethod
+    def _next_cursor(cursor, more):
+        """Returns the urlsafe cursor for the next page, or None if there is
+        no next page"""
+        return cursor.urlsafe() if more and cursor else None
+
+    @staticmethod
+    def _queue_average_tiles():
+        """Queues the task that recaches the average tiles remaining. The
+        task is named after the current AVERAGE_TILES_SECONDS window and
+        runs when it closes, so a burst of games queues it only once"""
+        window = int(time.time()) // AVERAGE_TILES_SECONDS
+        try:
+            taskqueue.add(
+                url='/tasks/cache_average_tiles',
+                name='cache-average-tiles-{}'.format(window),
+                countdown=(window + 1) * AVERAGE_TILES_SECONDS - time.time())
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
 
     @staticmethod
     def _cache_average_tiles():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_tiles_remaining = sum([game.tiles_remaining
-                                        for game in games])
-            average = float(total_tiles_remaining)/count
+        """Populates memcache with the average moves remaining of Games,
+        read from the running totals of active games"""
+        counts = counters.get_counts([counters.ACTIVE_GAMES,
+                                      counters.ACTIVE_TILES_REMAINING])
+        count = counts[counters.ACTIVE_GAMES]
+        if count > 0:
+            average = float(counts[counters.ACTIVE_TILES_REMAINING])/count
             memcache.set(MEMCACHE_TILES_REMAINING,
                          'The average tiles remaining is {:.2f}'.format(average))
 
+    @staticmethod
+    def _recount_active_games():
+        """Recounts the running totals of active games from the datastore,
+        correcting any drift. A projection query reads tiles_remaining
+        straight from the index, so no board is ever loaded"""
+        count = total = 0
+        for game in Game.query(Game.game_over == False).iter(
+                projection=[Game.tiles_remaining],
+                batch_size=RECOUNT_BATCH_SIZE):
+            count += 1
+            total += game.tiles_remaining
+        counters.set_count(counters.ACTIVE_GAMES, count)
+        counters.set_count(counters.ACTIVE_TILES_REMAINING, total)
+
 
 api = endpoints.api_server([MineSweeperApi])
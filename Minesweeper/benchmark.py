@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+
+"""benchmark.py - Microbenchmarks for the board engine. These run against the
+pure Python modules only, so they need neither App Engine nor a datastore.
+
+Usage: python benchmark.py [name ...]   (runs every benchmark by default)"""
+from __future__ import print_function
+
+import base64
+import json
+import pickle
+import random
+import sys
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import engine
+import grid
+from Minesweeper import Minesweeper
+
+BOARD_SIZES = [(8, 8), (16, 16), (16, 31), (64, 64), (128, 128)]
+
+
+def _legacy_connecting_indexes(stack_index, index):
+    """The coordinate-list scan grid.neighbors replaced, kept for comparison"""
+    nodes = []
+    x, y = stack_index[index]
+    for i in range(x-1, x+2):
+        for j in range(y-1, y+2):
+            if not (i == x and j == y):
+                try:
+                    nodes.append(stack_index.index((i, j)))
+                except ValueError:
+                    continue
+    return nodes
+
+
+def _per_call(func, number):
+    """:Returns: microseconds per call of func, best of three runs"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def bench_neighbors():
+    """Neighbor lookup cost per tile for growing board areas. The grid
+    columns should stay flat while the legacy scan grows with the area."""
+    print('{:>10} {:>8} {:>12} {:>12} {:>12}'.format(
+        'board', 'tiles', 'legacy us', 'table us', 'arith us'))
+    for x_range, y_range in BOARD_SIZES:
+        tiles = x_range * y_range
+        middle = tiles // 2 + y_range // 2
+        stack_index = [grid.coordinate(i, y_range) for i in range(tiles)]
+        grid.adjacency(x_range, y_range)
+        legacy = _per_call(
+            lambda: _legacy_connecting_indexes(stack_index, middle), 20)
+        table = _per_call(
+            lambda: grid.neighbors(middle, x_range, y_range), 100000)
+        arith = _per_call(
+            lambda: grid.connecting_indexes(middle, x_range, y_range), 100000)
+        print('{:>10} {:>8} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+            '{}x{}'.format(x_range, y_range), tiles, legacy, table, arith))
+
+
+CASCADE_BOARDS = [(16, 31), (100, 100), (1000, 1000)]
+
+
+def bench_cascade():
+    """Worst case cascade: a single mine in the corner, first click in the
+    opposite corner, so one flip opens every other tile on the board."""
+    print('{:>10} {:>10} {:>10} {:>14}'.format(
+        'board', 'flipped', 'ms', 'ns per tile'))
+    for x_range, y_range in CASCADE_BOARDS:
+        values = bytearray(x_range * y_range)
+        values[0] = 9
+        for node in grid.neighbors(0, x_range, y_range):
+            values[node] = 1
+        flipped = bytearray(x_range * y_range)
+        start = len(values) - 1
+        began = time.time()
+        reached = grid.flood_fill(start, x_range, y_range,
+                                  lambda node: values[node] == 0,
+                                  lambda node: flipped[node])
+        elapsed = time.time() - began
+        print('{:>10} {:>10} {:>10.1f} {:>14.1f}'.format(
+            '{}x{}'.format(x_range, y_range), len(reached) + 1,
+            elapsed * 1e3, elapsed * 1e9 / (len(reached) + 1)))
+
+
+DIFFICULTY_BOARDS = [(8, 8), (16, 16), (16, 31)]
+
+
+def bench_storage():
+    """Stored size and (de)serialization cost of a board: the pickled list
+    of tile dicts games used to carry against the packed byte board."""
+    print('{:>10} {:>12} {:>12} {:>14} {:>14}'.format(
+        'board', 'pickle B', 'packed B', 'pickle rt us', 'packed rt us'))
+    for x_range, y_range in DIFFICULTY_BOARDS:
+        stack = [{'coordinate': grid.coordinate(i, y_range), 'value': 0,
+                  'flip': False, 'flag': False}
+                 for i in range(x_range * y_range)]
+        board = bytes(bytearray(x_range * y_range))
+        pickled = pickle.dumps(stack, 2)
+        pickle_rt = _per_call(
+            lambda: pickle.loads(pickle.dumps(pickle.loads(pickled), 2)), 200)
+        packed_rt = _per_call(lambda: bytes(bytearray(board)), 20000)
+        print('{:>10} {:>12} {:>12} {:>14.1f} {:>14.1f}'.format(
+            '{}x{}'.format(x_range, y_range), len(pickled), len(board),
+            pickle_rt, packed_rt))
+
+
+def bench_response():
+    """Bytes and encode time of a one tile move: the full str() board dump
+    make_move used to return against the changed tiles only."""
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'board', 'full B', 'delta B', 'full us', 'delta us'))
+    for x_range, y_range in DIFFICULTY_BOARDS:
+        stack = [{'coordinate': grid.coordinate(i, y_range), 'value': 1,
+                  'flip': False, 'flag': False}
+                 for i in range(x_range * y_range)]
+        tiles = bytearray([grid.FLIPPED | 1] * (x_range * y_range))
+        changed = [x_range * y_range // 2]
+
+        def delta():
+            return json.dumps({'tiles': changed, 'values': [
+                grid.visible_value(tiles[tile]) for tile in changed]})
+        full = _per_call(lambda: json.dumps({'stack': str(stack)}), 200)
+        small = _per_call(delta, 20000)
+        print('{:>10} {:>12} {:>12} {:>12.1f} {:>12.1f}'.format(
+            '{}x{}'.format(x_range, y_range),
+            len(json.dumps({'stack': str(stack)})), len(delta()),
+            full, small))
+
+
+def bench_board_formats():
+    """JSON bytes and encode time of a full Expert board in each GameForm
+    board_format. packed goes out base64 encoded, as protojson sends it."""
+    x_range, y_range = DIFFICULTY_BOARDS[-1]
+    tiles = bytearray(x_range * y_range)
+    stack = [{'coordinate': grid.coordinate(i, y_range), 'value': 0,
+              'flip': False, 'flag': False} for i in range(len(tiles))]
+    encoders = [
+        ('repr', lambda: json.dumps({
+            'stack': str(stack),
+            'stack_index': str([grid.coordinate(i, y_range)
+                                for i in range(len(tiles))])})),
+        ('packed', lambda: json.dumps({
+            'packed_board': base64.b64encode(
+                grid.pack_visible(tiles)).decode('ascii')})),
+        ('ints', lambda: json.dumps({
+            'board': list(grid.visible_values(tiles))})),
+    ]
+    print('{:>10} {:>10} {:>10}'.format('format', 'bytes', 'us'))
+    for name, encode in encoders:
+        print('{:>10} {:>10} {:>10.1f}'.format(
+            name, len(encode()), _per_call(encode, 200)))
+
+
+def _legacy_place_mines(size, count, protected_tile, rng):
+    """The randint-and-reject loop grid.place_mines replaced"""
+    tiles = bytearray(size)
+    draws = 0
+    while count > 0:
+        index = rng.randint(0, size - 1)
+        draws += 1
+        if not (tiles[index] == grid.MINE or index == protected_tile):
+            tiles[index] = grid.MINE
+            count -= 1
+    return draws
+
+
+def bench_placement():
+    """Mine placement on a 100x100 board at rising densities: the legacy
+    rejection loop (draws and time, placement only) against sampling plus
+    the one pass proximity count."""
+    x_range = y_range = 100
+    size = x_range * y_range
+    print('{:>8} {:>8} {:>12} {:>12} {:>12}'.format(
+        'density', 'mines', 'legacy draws', 'legacy ms', 'sample ms'))
+    grid.adjacency(x_range, y_range)
+    for density in (0.1, 0.5, 0.9, 0.99):
+        count = int(size * density)
+        rng = random.Random(0)
+        began = time.time()
+        draws = _legacy_place_mines(size, count, 0, rng)
+        legacy = time.time() - began
+        began = time.time()
+        grid.place_mines(x_range, y_range, count, [0], rng)
+        sampled = time.time() - began
+        print('{:>8.0%} {:>8} {:>12} {:>12.1f} {:>12.1f}'.format(
+            density, count, draws, legacy * 1e3, sampled * 1e3))
+
+
+GENERATION_BOARDS = [(16, 31, 99), (256, 256, 10000), (2000, 2000, 600000)]
+
+
+def _generation_ms(x_range, y_range, count, module):
+    """:Returns: ms to generate a board with grid.numpy set to module"""
+    installed = grid.load_numpy()
+    grid.numpy = module
+    try:
+        began = time.time()
+        grid.place_mines(x_range, y_range, count, [0], random.Random(0))
+        return (time.time() - began) * 1e3
+    finally:
+        grid.numpy = installed
+
+
+def bench_generation():
+    """Full board generation (mines and numbers) with the pure Python
+    generator against the NumPy one, where NumPy is installed and the
+    board is big enough to use it."""
+    print('{:>10} {:>8} {:>12} {:>12}'.format(
+        'board', 'mines', 'python ms', 'numpy ms'))
+    for x_range, y_range, count in GENERATION_BOARDS:
+        python = _generation_ms(x_range, y_range, count, None)
+        numpy = float('nan')
+        if (x_range * y_range >= grid.NUMPY_MIN_TILES and
+                grid.load_numpy() is not None):
+            numpy = _generation_ms(x_range, y_range, count, grid.numpy)
+        print('{:>10} {:>8} {:>12.1f} {:>12.1f}'.format(
+            '{}x{}'.format(x_range, y_range), count, python, numpy))
+
+
+REPLAY_DIFFICULTIES = [('beginner', 8, 8, 10), ('intermediate', 16, 16, 40),
+                       ('expert', 16, 31, 99)]
+REPLAY_GAMES = 50
+
+
+def synthetic_log(x_range, y_range, num_of_bombs, seed):
+    """Plays a game from seed that reveals every safe tile in a random
+    order, flagging some mines on the way and chording numbers whose mines
+    are all flagged. It peeks at the board, so it always wins and the logs
+    run as long as a game can.
+    :Returns: the list of move records"""
+    rng = random.Random(seed)
+    state = engine.Engine(x_range, y_range, num_of_bombs, seed=seed)
+    records = []
+    while not state.game_over:
+        hidden = [i for i, byte in enumerate(state.tiles)
+                  if not byte & (grid.FLIPPED | grid.FLAGGED)]
+        tile = rng.choice(hidden)
+        kind = grid.MOVE_FLIP
+        if state.tiles[tile] == grid.MINE:
+            if state.first_move:
+                kind = grid.MOVE_FLIP
+            elif rng.random() < 0.5 and state.flags_remaining:
+                kind = grid.MOVE_FLAG
+            else:
+                continue
+        elif not state.first_move and rng.random() < 0.2:
+            numbers = [i for i, byte in enumerate(state.tiles)
+                       if byte & grid.FLIPPED and
+                       0 < byte & grid.VALUE_MASK < grid.MINE]
+            if numbers:
+                tile, kind = rng.choice(numbers), grid.MOVE_CHORD
+        record = grid.pack_move(tile, kind)
+        if state.play(record):
+            records.append(record)
+    return records
+
+
+def _replay_all(x_range, y_range, num_of_bombs, logs):
+    """Replays every (seed, records) log from scratch"""
+    for seed, records in logs:
+        engine.replay(x_range, y_range, num_of_bombs, seed, records)
+
+
+def _bytes_per_move(x_range, y_range, num_of_bombs, logs):
+    """:Returns: the average peak of memory allocated while one move is
+    played, in bytes, or nan without tracemalloc.reset_peak (Python 3.9+)"""
+    if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+        return float('nan')
+    total = moves = 0
+    tracemalloc.start()
+    try:
+        for seed, records in logs:
+            state = engine.Engine(x_range, y_range, num_of_bombs, seed=seed)
+            for record in records:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                state.play(record)
+                total += tracemalloc.get_traced_memory()[1] - before
+                moves += 1
+    finally:
+        tracemalloc.stop()
+    return float(total) / moves
+
+
+def bench_replay():
+    """Replays synthetic move logs through the engine for every difficulty:
+    moves per second (board layout from the seed included) and the memory
+    allocated per move. The logs use the same records as the MoveLog, so
+    recorded games can be replayed the same way."""
+    print('{:>14} {:>8} {:>12} {:>14}'.format(
+        'difficulty', 'moves', 'moves/s', 'alloc B/move'))
+    for name, x_range, y_range, num_of_bombs in REPLAY_DIFFICULTIES:
+        logs = [(seed, synthetic_log(x_range, y_range, num_of_bombs, seed))
+                for seed in range(REPLAY_GAMES)]
+        moves = sum(len(records) for seed, records in logs)
+        seconds = min(timeit.repeat(
+            lambda: _replay_all(x_range, y_range, num_of_bombs, logs),
+            number=1, repeat=3))
+        print('{:>14} {:>8} {:>12.0f} {:>14.0f}'.format(
+            name, moves, moves / seconds,
+            _bytes_per_move(x_range, y_range, num_of_bombs, logs)))
+
+
+LIVE_GAMES = 10000
+LEGACY_GAMES = 100
+
+
+def _traced_bytes(build):
+    """:Returns: the bytes still allocated by whatever build() returns, or
+    nan without tracemalloc"""
+    if tracemalloc is None:
+        return float('nan')
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()  # alive until measured
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _legacy_game(x_range, y_range):
+    """The per tile lists a Minesweeper used to carry, as stack and
+    stack_index"""
+    stack = [[(i, j), 0, False] for i in range(x_range)
+             for j in range(y_range)]
+    return stack, [tile[0] for tile in stack]
+
+
+def bench_instances():
+    """Memory held per live Minesweeper: LIVE_GAMES seeded games kept at
+    once, against the stack and stack_index lists every game used to carry
+    (measured over LEGACY_GAMES games)."""
+    print('{:>14} {:>14} {:>14}'.format(
+        'difficulty', 'legacy B/game', 'slots B/game'))
+    for name, x_range, y_range, num_of_bombs in REPLAY_DIFFICULTIES:
+        difficulty = Minesweeper.DIFFICULTIES.index(name.upper()) + 1
+        legacy = _traced_bytes(lambda: [_legacy_game(x_range, y_range)
+                                        for _ in range(LEGACY_GAMES)])
+        live = _traced_bytes(lambda: [Minesweeper(difficulty, seed=seed)
+                                      for seed in range(LIVE_GAMES)])
+        print('{:>14} {:>14.0f} {:>14.0f}'.format(
+            name, legacy / LEGACY_GAMES, live / LIVE_GAMES))
+
+
+BENCHMARKS = {
+    'board_formats': bench_board_formats,
+    'cascade': bench_cascade,
+    'generation': bench_generation,
+    'instances': bench_instances,
+    'neighbors': bench_neighbors,
+    'placement': bench_placement,
+    'replay': bench_replay,
+    'response': bench_response,
+    'storage': bench_storage,
+}
+
+
+def main(names):
+    for name in names or sorted(BENCHMARKS):
+        print('== {} =='.format(name))
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+"""board_pool.py - Keeps a pool of ready-made mine layouts for every
+difficulty in memcache, so neither new_game nor the first move has to
+generate a board. Each layout is a (seed, board) pair, the board packed one
+byte per tile as in grid.py. Layouts are laid out from their seed exactly as
+engine.Engine.arm would, so a game started from the pool can still be
+rebuilt from its seed and first move."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+import grid
+from models import BOARD_SIZES
+
+POOL_SIZE = 50
+CAS_RETRIES = 5
+MEMCACHE_BOARD_POOL = 'BOARD_POOL_{}'
+MEMCACHE_REFILL_LOCK = 'BOARD_POOL_REFILL_{}'
+REFILL_LOCK_SECONDS = 30
+
+
+def generate(difficulty):
+    """:Returns: a fresh (seed, board) layout for a difficulty"""
+    x_range, y_range, num_of_bombs = BOARD_SIZES[difficulty]
+    seed = random.getrandbits(32)
+    tiles = grid.place_mines(x_range, y_range, num_of_bombs, (),
+                             random.Random(seed))
+    return seed, bytes(tiles)
+
+
+def claim(difficulty):
+    """Takes one layout out of the pool, asking for a refill when the pool
+    runs low.
+    :Returns: a (seed, board) layout, or None if the pool is empty"""
+    client = memcache.Client()
+    key = MEMCACHE_BOARD_POOL.format(difficulty)
+    for _ in range(CAS_RETRIES):
+        pool = client.gets(key)
+        if not pool:
+            break
+        if client.cas(key, pool[1:]):
+            if len(pool) - 1 < POOL_SIZE // 2:
+                request_refill(difficulty)
+            return pool[0]
+    request_refill(difficulty)
+    return None
+
+
+def request_refill(difficulty):
+    """Queues a refill task, at most one per difficulty every
+    REFILL_LOCK_SECONDS"""
+    if memcache.add(MEMCACHE_REFILL_LOCK.format(difficulty), True,
+                    time=REFILL_LOCK_SECONDS):
+        taskqueue.add(url='/tasks/fill_board_pool',
+                      params={'difficulty': difficulty})
+
+
+def fill(difficulty):
+    """Tops the pool for a difficulty back up to POOL_SIZE layouts"""
+    client = memcache.Client()
+    key = MEMCACHE_BOARD_POOL.format(difficulty)
+    for _ in range(CAS_RETRIES):
+        pool = client.gets(key)
+        missing = POOL_SIZE - len(pool or [])
+        if missing <= 0:
+            return
+        layouts = [generate(difficulty) for _ in range(missing)]
+        if pool is None:
+            if memcache.add(key, layouts):
+                return
+        elif client.cas(key, pool + layouts):
+            return
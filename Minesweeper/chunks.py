@@ -0,0 +1,180 @@
+"""chunks.py - Boards too big to keep in one entity. A chunked board is split
+into CHUNK_ROWS by CHUNK_COLUMNS blocks of packed tiles (see grid.py). The
+mines of each chunk are laid out from the game's seed and the chunk's index
+alone, so any chunk can be generated without the rest of the board, and a
+chunk only has to be stored once a move changes it. A chunk is loaded or
+generated the first time one of its tiles is read, so a move costs memory
+and I/O in proportion to the chunks it touches, not to the board's size."""
+
+import random
+
+import grid
+
+CHUNK_ROWS = 64
+CHUNK_COLUMNS = 64
+CHUNK_TILES = CHUNK_ROWS * CHUNK_COLUMNS
+
+
+class ChunkedBoard(object):
+    """A board of packed tiles that is indexed like the bytearray boards,
+    by row-major tile index. loader(chunk) returns the stored bytes of a
+    chunk, or None if it was never stored. Chunks are CHUNK_TILES bytes,
+    row-major within the chunk; chunks on the bottom and right edges only
+    use part of theirs. dirty holds the chunks changed since take_dirty
+    was last called."""
+    __slots__ = ('x_range', 'y_range', 'num_of_bombs', 'seed', 'protected',
+                 'loader', 'chunks', 'dirty', 'rows', 'columns',
+                 '_mine_counts', '_mines')
+
+    def __init__(self, x_range, y_range, num_of_bombs, seed=None,
+                 protected=None, loader=None):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.num_of_bombs = num_of_bombs
+        self.seed = seed
+        # The first tile flipped, which never holds a mine
+        self.protected = protected
+        self.loader = loader
+        self.chunks = {}
+        self.dirty = set()
+        self.rows = -(-x_range // CHUNK_ROWS)
+        self.columns = -(-y_range // CHUNK_COLUMNS)
+        self._mine_counts = None
+        self._mines = {}
+
+    def __len__(self):
+        return self.x_range * self.y_range
+
+    def __getitem__(self, index):
+        chunk, offset = self.locate(index)
+        return self.chunk(chunk)[offset]
+
+    def __setitem__(self, index, byte):
+        chunk, offset = self.locate(index)
+        self.chunk(chunk)[offset] = byte
+        self.dirty.add(chunk)
+
+    @property
+    def num_chunks(self):
+        return self.rows * self.columns
+
+    def locate(self, index):
+        """:Returns: the (chunk, offset) pair holding a tile index"""
+        x, y = divmod(index, self.y_range)
+        return ((x // CHUNK_ROWS) * self.columns + y // CHUNK_COLUMNS,
+                (x % CHUNK_ROWS) * CHUNK_COLUMNS + y % CHUNK_COLUMNS)
+
+    def bounds(self, chunk):
+        """:Returns: the (x, y, rows, columns) of a chunk: the coordinate
+        of its first tile and how many rows and columns of it are used"""
+        row, column = divmod(chunk, self.columns)
+        x, y = row * CHUNK_ROWS, column * CHUNK_COLUMNS
+        return (x, y, min(CHUNK_ROWS, self.x_range - x),
+                min(CHUNK_COLUMNS, self.y_range - y))
+
+    def arm(self, seed, protected):
+        """Fixes the layout: the mines come from seed and are never on the
+        protected tile. Chunks read before are dropped"""
+        self.seed = seed
+        self.protected = protected
+        self.chunks.clear()
+        self.dirty.clear()
+        self._mine_counts = None
+        self._mines.clear()
+
+    def chunk(self, chunk):
+        """:Returns: the bytearray of a chunk, loading or generating it the
+        first time it is used"""
+        data = self.chunks.get(chunk)
+        if data is None:
+            stored = self.loader(chunk) if self.loader else None
+            if stored is not None:
+                data = bytearray(stored)
+            else:
+                data = self.generate(chunk)
+            self.chunks[chunk] = data
+        return data
+
+    def chunk_tiles(self, chunk):
+        """:Returns: a bytearray of just the tiles a chunk uses, row by
+        row"""
+        _, _, rows, columns = self.bounds(chunk)
+        data = self.chunk(chunk)
+        tiles = bytearray()
+        for row in range(rows):
+            tiles += data[row * CHUNK_COLUMNS:row * CHUNK_COLUMNS + columns]
+        return tiles
+
+    def take_dirty(self):
+        """:Returns: a {chunk: bytes} dict of the chunks changed since the
+        last call"""
+        changed = dict((chunk, bytes(self.chunks[chunk]))
+                       for chunk in self.dirty)
+        self.dirty.clear()
+        return changed
+
+    def mine_counts(self):
+        """:Returns: the number of mines in every chunk. Each chunk gets its
+        share of num_of_bombs by area, rounded down, and the mines left over
+        go one each to chunks drawn from the seed, so the density is even
+        over the board. A chunk always keeps a tile free for the first move.
+        :Raises: ValueError if the mines don't fit"""
+        if self._mine_counts is None:
+            area = self.x_range * self.y_range
+            sizes = [rows * columns for _, _, rows, columns
+                     in map(self.bounds, range(self.num_chunks))]
+            counts = [size * self.num_of_bombs // area for size in sizes]
+            room = [chunk for chunk, count in enumerate(counts)
+                    if count + 1 < sizes[chunk]]
+            left = self.num_of_bombs - sum(counts)
+            if self.num_of_bombs >= area or left > len(room):
+                raise ValueError('Too many mines for the board')
+            for chunk in random.Random(self.seed).sample(room, left):
+                counts[chunk] += 1
+            self._mine_counts = counts
+        return self._mine_counts
+
+    def mines(self, chunk):
+        """:Returns: the set of tile indexes holding a chunk's mines, drawn
+        from the seed and the chunk index"""
+        found = self._mines.get(chunk)
+        if found is None:
+            x, y, rows, columns = self.bounds(chunk)
+            tiles = [(x + row) * self.y_range + y + column
+                     for row in range(rows) for column in range(columns)]
+            if self.protected in tiles:
+                tiles.remove(self.protected)
+            rng = random.Random(self.seed << 32 | chunk)
+            found = set(rng.sample(tiles, self.mine_counts()[chunk]))
+            self._mines[chunk] = found
+        return found
+
+    def generate(self, chunk):
+        """Lays a chunk out from the seed: its mines, and the number of
+        every other tile, which counts the mines of neighboring chunks too.
+        The numbers come from grid.count_proximities.
+        Before the board is armed every tile is an empty 0.
+        :Returns: the chunk as a bytearray"""
+        data = bytearray(CHUNK_TILES)
+        if self.seed is None:
+            return data
+        # The chunk with a border of one tile, where the mines of the
+        # neighboring chunks that touch it are marked too
+        x, y, rows, columns = self.bounds(chunk)
+        width = columns + 2
+        window = bytearray((rows + 2) * width)
+        row, column = divmod(chunk, self.columns)
+        for i in range(max(row - 1, 0), min(row + 2, self.rows)):
+            for j in range(max(column - 1, 0), min(column + 2, self.columns)):
+                for index in self.mines(i * self.columns + j):
+                    mine_x, mine_y = divmod(index, self.y_range)
+                    if (x - 1 <= mine_x <= x + rows and
+                            y - 1 <= mine_y <= y + columns):
+                        window[(mine_x - x + 1) * width + mine_y - y + 1] = (
+                            grid.MINE)
+        grid.count_proximities(window, rows + 2, width)
+        for i in range(rows):
+            start = (i + 1) * width + 1
+            data[i * CHUNK_COLUMNS:i * CHUNK_COLUMNS + columns] = (
+                window[start:start + columns])
+        return data
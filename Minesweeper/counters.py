@@ -0,0 +1,102 @@
+"""counters.py - Sharded counters for game statistics. Each counter is split
+over NUM_SHARDS entities and every increment lands on a random one, so games
+finishing at the same time rarely touch the same entity. Reads sum the
+shards once and then serve the total from memcache for a minute, which
+increments keep up to date."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+MEMCACHE_COUNTER = 'COUNTER_'
+COUNTER_CACHE_SECONDS = 60
+
+GAMES_STARTED = 'games_started'
+GAMES_WON = 'games_won'
+GAMES_LOST = 'games_lost'
+# Sum of tiles_remaining over finished games
+TILES_REMAINING = 'tiles_remaining'
+# Running totals over unfinished games, kept up to date as games start,
+# are flushed and end (see Game.active_count_deltas)
+ACTIVE_GAMES = 'active_games'
+ACTIVE_TILES_REMAINING = 'active_tiles_remaining'
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter, keyed '<name>-<shard>'"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def difficulty_counter(stat, difficulty):
+    """Returns the counter name of a statistic for one difficulty"""
+    return '{}_{}'.format(stat, difficulty)
+
+
+def _shard_key(name, shard):
+    return ndb.Key(CounterShard, '{}-{}'.format(name, shard))
+
+
+def increment(deltas):
+    """Adds each delta in a {name: delta} dict to its counter. Every
+    counter gets a random shard and all of them are updated in a single
+    cross-group transaction, so up to 25 counters can move together"""
+    increment_async(deltas).get_result()
+
+
+@ndb.tasklet
+def increment_async(deltas):
+    """increment, returning a future so the transaction can run alongside
+    other RPCs"""
+    keys = dict((name, _shard_key(name, random.randint(0, NUM_SHARDS - 1)))
+                for name in deltas)
+
+    @ndb.transactional_tasklet(xg=len(keys) > 1)
+    def update():
+        shards = yield ndb.get_multi_async(keys.values())
+        shards = [shard or CounterShard(key=key)
+                  for key, shard in zip(keys.values(), shards)]
+        for name, shard in zip(keys, shards):
+            shard.count += deltas[name]
+        yield ndb.put_multi_async(shards)
+    yield update()
+    for name, delta in deltas.items():
+        if delta > 0:
+            memcache.incr(MEMCACHE_COUNTER + name, delta)
+        elif delta < 0:
+            memcache.decr(MEMCACHE_COUNTER + name, -delta)
+
+
+def set_count(name, value):
+    """Sets a counter to value, e.g. after a recount. Every shard is read
+    in one cross-group transaction and the difference is added to the
+    first, so concurrent increments are never lost"""
+    keys = [_shard_key(name, shard) for shard in range(NUM_SHARDS)]
+
+    @ndb.transactional(xg=True)
+    def update():
+        shards = ndb.get_multi(keys)
+        first = shards[0] or CounterShard(key=keys[0])
+        first.count += value - sum(shard.count for shard in shards if shard)
+        first.put()
+    update()
+    memcache.set(MEMCACHE_COUNTER + name, value, time=COUNTER_CACHE_SECONDS)
+
+
+def get_counts(names):
+    """Returns a {name: total} dict for the named counters, summing the
+    shards of those that aren't cached with a single get_multi"""
+    counts = memcache.get_multi(names, key_prefix=MEMCACHE_COUNTER)
+    missing = [name for name in names if name not in counts]
+    if missing:
+        shards = ndb.get_multi([_shard_key(name, shard) for name in missing
+                                for shard in range(NUM_SHARDS)])
+        for i, name in enumerate(missing):
+            counts[name] = sum(shard.count for shard in
+                               shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS]
+                               if shard)
+        memcache.add_multi(dict((name, counts[name]) for name in missing),
+                           key_prefix=MEMCACHE_COUNTER,
+                           time=COUNTER_CACHE_SECONDS)
+    return counts
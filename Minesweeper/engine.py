@@ -0,0 +1,178 @@
+"""engine.py - The rules of Minesweeper, kept apart from storage so the Game
+model, the standalone Minesweeper class and offline tools all play the same
+game. A board is laid out from a seed, so a game is fully described by its
+seed and its moves (see replay). Every move returns the indexes of the tiles
+it changed."""
+
+import random
+
+import chunks
+import grid
+
+# difficulty: (x_range, y_range, num_of_bombs)
+BOARD_SIZES = {
+    1: (8, 8, 10),
+    2: (16, 16, 40),
+    3: (16, 31, 99),
+}
+for _x_range, _y_range, _ in BOARD_SIZES.values():
+    grid.use_adjacency_table(_x_range, _y_range)
+
+
+class Engine(object):
+    """One game's board and counts. tiles is a bytearray of packed tiles
+    (see grid.py), or a chunks.ChunkedBoard for boards too big to hold
+    whole, and tiles_remaining counts the safe tiles still hidden.
+    Pass seed to lay the board out from it, or tiles to carry on from a
+    stored board; with neither, a seed is drawn on the first reveal."""
+    __slots__ = ('x_range', 'y_range', 'num_of_bombs', 'seed', 'tiles',
+                 'first_move', 'flags_remaining', 'tiles_remaining',
+                 'game_over', 'win')
+
+    def __init__(self, x_range, y_range, num_of_bombs, seed=None, tiles=None,
+                 first_move=True, flags_remaining=None, tiles_remaining=None,
+                 game_over=False, win=False):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.num_of_bombs = num_of_bombs
+        self.seed = seed
+        if tiles is not None:
+            self.tiles = tiles
+        elif seed is not None:
+            self.tiles = grid.place_mines(x_range, y_range, num_of_bombs, (),
+                                          random.Random(seed))
+        else:
+            self.tiles = bytearray(x_range * y_range)
+        self.first_move = first_move
+        self.flags_remaining = (num_of_bombs if flags_remaining is None
+                                else flags_remaining)
+        self.tiles_remaining = (x_range * y_range - num_of_bombs
+                                if tiles_remaining is None
+                                else tiles_remaining)
+        self.game_over = game_over
+        self.win = win
+
+    def arm(self, protected_tile):
+        """Readies the board for the first move. The mines are laid out
+        from the seed, drawing one if there is none yet, and any mine on
+        protected_tile is moved elsewhere. The board only depends on the
+        seed and protected_tile, so it can always be rebuilt. A chunked
+        board lays its chunks out itself, keeping only protected_tile
+        clear."""
+        if isinstance(self.tiles, chunks.ChunkedBoard):
+            if self.seed is None:
+                self.seed = random.getrandbits(32)
+            self.tiles.arm(self.seed, protected_tile)
+            self.first_move = False
+            return
+        if self.seed is None:
+            self.seed = random.getrandbits(32)
+            self.tiles = grid.place_mines(self.x_range, self.y_range,
+                                          self.num_of_bombs, (),
+                                          random.Random(self.seed))
+        grid.move_mines(self.tiles, self.x_range, self.y_range,
+                        [protected_tile], random.Random(self.seed))
+        self.first_move = False
+
+    def reveal(self, tile):
+        """Flips tile, cascading over blank tiles, and arms the board first
+        if this is the first move. Revealing a flagged tile takes the flag
+        off instead. Revealing a mine loses the game; revealing the last
+        safe tile wins it.
+        :Returns: the indexes of the tiles that changed"""
+        if self.game_over:
+            return []
+        if self.first_move:
+            self.arm(tile)
+        byte = self.tiles[tile]
+        if byte & grid.FLAGGED:
+            self.tiles[tile] = byte & ~grid.FLAGGED
+            self.flags_remaining += 1
+            return [tile]
+        if byte & grid.FLIPPED:
+            return []
+        return self._open([tile])
+
+    def flag(self, tile):
+        """Flags a hidden tile. Nothing can be flagged before the first
+        reveal arms the board.
+        :Returns: the indexes of the tiles that changed
+        :Raises: ValueError if there are no flags left"""
+        if self.game_over or self.first_move:
+            return []
+        byte = self.tiles[tile]
+        if byte & (grid.FLIPPED | grid.FLAGGED):
+            return []
+        if self.flags_remaining == 0:
+            raise ValueError('No flags left')
+        self.tiles[tile] = byte | grid.FLAGGED
+        self.flags_remaining -= 1
+        return [tile]
+
+    def chord(self, tile):
+        """Reveals every hidden, unflagged neighbor of a flipped number once
+        exactly that many of its neighbors are flagged. A misplaced flag
+        means a mine is revealed and the game is lost.
+        :Returns: the indexes of the tiles that changed"""
+        if self.game_over or self.first_move:
+            return []
+        byte = self.tiles[tile]
+        value = byte & grid.VALUE_MASK
+        if not byte & grid.FLIPPED or value in (0, grid.MINE):
+            return []
+        nodes = grid.neighbors(tile, self.x_range, self.y_range)
+        if sum(1 for node in nodes
+               if self.tiles[node] & grid.FLAGGED) != value:
+            return []
+        return self._open([node for node in nodes if not self.tiles[node] &
+                           (grid.FLIPPED | grid.FLAGGED)])
+
+    def play(self, record):
+        """Plays a move record (see grid.pack_move).
+        :Returns: the indexes of the tiles that changed"""
+        tile, kind = grid.unpack_move(record)
+        if kind == grid.MOVE_FLAG:
+            return self.flag(tile)
+        if kind == grid.MOVE_CHORD:
+            return self.chord(tile)
+        return self.reveal(tile)
+
+    def _open(self, start):
+        """Flips the start tiles and cascades from the blank ones, then
+        settles the counts and the outcome"""
+        tiles = self.tiles
+        changed = []
+        safe = 0
+        for tile in start:
+            if tiles[tile] & (grid.FLIPPED | grid.FLAGGED):
+                continue
+            tiles[tile] |= grid.FLIPPED
+            changed.append(tile)
+            value = tiles[tile] & grid.VALUE_MASK
+            if value == grid.MINE:
+                self.game_over = True
+                continue
+            safe += 1
+            if value == 0:
+                flipped = grid.flood_fill(
+                    tile, self.x_range, self.y_range,
+                    lambda node: tiles[node] & grid.VALUE_MASK == 0,
+                    lambda node: tiles[node] & (grid.FLIPPED | grid.FLAGGED))
+                for node in flipped:
+                    tiles[node] |= grid.FLIPPED
+                changed.extend(flipped)
+                safe += len(flipped)
+        self.tiles_remaining -= safe
+        if not self.game_over and self.tiles_remaining == 0:
+            self.win = True
+            self.game_over = True
+        return changed
+
+
+def replay(x_range, y_range, num_of_bombs, seed, records):
+    """Plays move records on the board laid out from seed.
+    :Returns: the Engine after the last move"""
+    state = Engine(x_range, y_range, num_of_bombs, seed=seed)
+    for record in records:
+        state.play(record)
+    return state
@@ -0,0 +1,212 @@
+"""game_session.py - Write-behind cache for games being played. Between moves
+a game lives in memcache, and make_move reads and updates it there with
+gets/cas. The Game entity is only written when the game ends, after
+FLUSH_EVERY_MOVES moves, after FLUSH_AFTER_SECONDS, or by the flush task
+queued when a session first falls behind the datastore. Chunked games are
+the exception: their changed chunks are written with the game on every move.
+Each write is a transaction that checks the stored game is older.
+
+Every move that isn't flushed puts the game's pending move records in a
+small MoveJournal entity once the session is stored, which is far cheaper
+than writing the board. If memcache evicts a session, the next load reads
+the last flushed entity and plays the journaled moves it is missing, so no
+move a client was told about is lost."""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+from google.appengine.ext import ndb
+
+import counters
+from models import Game, MoveJournal
+from utils import get_by_urlsafe
+
+MEMCACHE_GAME_SESSION = 'GAME_SESSION_{}'
+SESSION_SECONDS = 60 * 60
+FLUSH_EVERY_MOVES = 10
+FLUSH_AFTER_SECONDS = 60
+CAS_RETRIES = 3
+
+
+class GameSession(object):
+    """A game held in memcache, with the version last written to the
+    datastore and when that happened"""
+
+    def __init__(self, urlsafe_key, game, flushed_version, flushed_at,
+                 client, cached):
+        self.urlsafe_key = urlsafe_key
+        self.game = game
+        self.flushed_version = flushed_version
+        self.flushed_at = flushed_at
+        self._client = client
+        self.cached = cached
+        # Counter changes taken by flush, applied once the session is stored
+        self.deltas = {}
+        # The MoveJournal put started by save, see wait
+        self.journaled = None
+
+    @classmethod
+    def load(cls, urlsafe_key):
+        """Returns the session for a game, reading the Game entity only when
+        memcache doesn't have it. Returns None if the game does not exist"""
+        client = memcache.Client()
+        cached = client.gets(MEMCACHE_GAME_SESSION.format(urlsafe_key))
+        if cached:
+            game, flushed_version, flushed_at = cached
+            return cls(urlsafe_key, game, flushed_version, flushed_at,
+                       client, True)
+        game = get_by_urlsafe(urlsafe_key, Game)
+        if not game:
+            return None
+        flushed_version = game.version
+        journal = MoveJournal.get_by_id(1, parent=game.key)
+        if journal:
+            game.catch_up(journal)
+        return cls(urlsafe_key, game, flushed_version, time.time(), client,
+                   False)
+
+    @classmethod
+    def start(cls, game):
+        """Caches a game that was just created and stored"""
+        memcache.add(MEMCACHE_GAME_SESSION.format(game.key.urlsafe()),
+                     (game, game.version, time.time()), time=SESSION_SECONDS)
+
+    @property
+    def dirty(self):
+        return self.game.version > self.flushed_version
+
+    def save(self, also=(), deltas=None):
+        """Stores the game after a move, flushing it to the datastore as
+        well if the game is over or enough moves or time have piled up.
+        also and deltas force a flush. Once the store succeeds, the entities
+        in also, e.g. the User and Score of a game that just ended, are
+        written and the counters moved by deltas and the flush's changes; a
+        move retried after a failed store would otherwise count twice.
+        Returns False if another request changed the game after it was
+        loaded; the move must then be retried from a fresh load"""
+        falling_behind = self.game.version - self.flushed_version == 1
+        if also or deltas or self.game.game_over or self.game.chunked or (
+                self.game.version - self.flushed_version >= FLUSH_EVERY_MOVES
+                or time.time() - self.flushed_at >= FLUSH_AFTER_SECONDS):
+            if not self.flush(deltas):
+                return False
+        elif not self.store():
+            return False
+        self.apply_results(also)
+        if self.dirty:
+            # Only after the store, so a move that lost the race is never
+            # journaled. Nothing below reads it, so the caller waits for it
+            # once its response is built
+            self.journaled = self.game.journal().put_async()
+        if falling_behind and self.dirty:
+            taskqueue.add(url='/tasks/flush_game_session',
+                          params={'urlsafe_game_key': self.urlsafe_key},
+                          countdown=FLUSH_AFTER_SECONDS)
+        return True
+
+    def wait(self):
+        """Waits for the MoveJournal put the last save started, if any"""
+        if self.journaled:
+            self.journaled.get_result()
+            self.journaled = None
+
+    def flush(self, deltas=None):
+        """Stores the session and writes the game to the datastore, taking
+        the changes to the running totals of active games since the last
+        flush, which apply_results makes with the counter changes in deltas.
+        Every write goes through _put_async, so an older copy of the game
+        never replaces a newer one. A plain game is written only once its
+        session is stored, so only the request that won the
+        compare-and-set writes it. A chunked game is written first instead:
+        its chunks are only kept in the datastore, so they must be there
+        before another request can load the session.
+        Returns False if another request changed the game after it was
+        loaded"""
+        game = self.game
+        page = game.take_move_page()
+        entities = [game] + ([page] if page else [])
+        self.deltas = dict(deltas or {}, **game.active_count_deltas())
+        self.flushed_version = game.version
+        self.flushed_at = time.time()
+        if game.chunked:
+            entities.extend(game.take_chunks())
+            return self._put_async(entities).get_result() and self.store()
+        if not self.store():
+            return False
+        if self._put_async(entities).get_result():
+            return True
+        # The datastore already has a later copy, so memcache must have
+        # evicted the session and another request reloaded it while this
+        # one ran. Drop this copy so the move is retried from the datastore
+        discard(self.urlsafe_key)
+        return False
+
+    def _put_async(self, entities):
+        """Writes the game with its MoveLog page and changed chunks in one
+        transaction that first checks the stored game is older than this
+        one. The page and chunks are children of the game, so they share
+        its entity group.
+        :Returns: a future for True, or for False if nothing was written"""
+        key, version = self.game.key, self.game.version
+
+        @ndb.transactional_tasklet
+        def put():
+            stored = yield key.get_async(use_cache=False)
+            if not stored or stored.version >= version:
+                raise ndb.Return(False)
+            yield ndb.put_multi_async(entities)
+            raise ndb.Return(True)
+        return put()
+
+    def apply_results(self, also=()):
+        """Writes what must only be written once a move is stored: the
+        entities in also, in one put_multi_async batch, and the counter
+        changes the last flush took, in a transaction alongside it"""
+        deltas, self.deltas = self.deltas, {}
+        futures = ndb.put_multi_async(list(also)) if also else []
+        if deltas:
+            futures.append(counters.increment_async(deltas))
+        for future in futures:
+            future.get_result()
+
+    def store(self):
+        """Writes the session to memcache. Returns False if another request
+        stored the game after this one loaded it"""
+        key = MEMCACHE_GAME_SESSION.format(self.urlsafe_key)
+        value = (self.game, self.flushed_version, self.flushed_at)
+        if self.cached:
+            stored = self._client.cas(key, value, time=SESSION_SECONDS)
+        else:
+            stored = self._client.add(key, value, time=SESSION_SECONDS)
+        self.cached = stored
+        return stored
+
+
+def flush(urlsafe_key):
+    """Writes a cached game to the datastore if it has unflushed moves.
+    Called by the flush task a session queues when it falls behind"""
+    for _ in range(CAS_RETRIES):
+        session = GameSession.load(urlsafe_key)
+        if not session or not session.cached or not session.dirty:
+            return
+        if session.flush():
+            session.apply_results()
+            return
+
+
+def discard(urlsafe_key):
+    """Drops a game's session, e.g. when the game is deleted"""
+    memcache.delete(MEMCACHE_GAME_SESSION.format(urlsafe_key))
+
+
+def latest(games):
+    """Returns games with every entity that has a cached session swapped
+    for the cached, newer copy"""
+    sessions = memcache.get_multi(
+        [game.key.urlsafe() for game in games],
+        key_prefix=MEMCACHE_GAME_SESSION.format(''))
+    return [sessions[game.key.urlsafe()][0]
+            if game.key.urlsafe() in sessions else game
+            for game in games]
@@ -0,0 +1,292 @@
+"""grid.py - Board geometry shared by the Game model and the standalone
+Minesweeper class. Tiles are stored row-major, so the tile at index i sits at
+coordinate divmod(i, y_range) and its neighbors can be found with plain
+arithmetic instead of searching a coordinate list."""
+
+import random
+import struct
+from collections import deque
+
+# Packed tiles take one byte each. The low nibble holds the number of
+# neighboring mines, or MINE; the flag bits above it hold the tile's state.
+MINE = 0x09
+VALUE_MASK = 0x0f
+FLIPPED = 0x10
+FLAGGED = 0x20
+
+# What a player may see of a tile: its number (or MINE) once flipped,
+# otherwise one of these marks, so hidden mines never leave the server.
+FLAG_MARK = 10
+HIDDEN_MARK = 11
+
+# A move is recorded as a 32 bit integer, the tile index shifted above a
+# two bit move kind.
+MOVE_FLIP = 0
+MOVE_FLAG = 1
+MOVE_CHORD = 2
+MOVE_KIND_BITS = 2
+MOVE_KIND_MASK = (1 << MOVE_KIND_BITS) - 1
+
+# Boards with at least this many tiles are generated with NumPy when it is
+# installed. Smaller boards, every standard difficulty included, always use
+# the pure Python generator, so their layout for a seed never depends on
+# whether NumPy is around.
+NUMPY_MIN_TILES = 1 << 16
+
+# Set by load_numpy the first time a board that big is generated
+numpy = None
+_numpy_tried = False
+
+_adjacency_tables = {}
+# Board sizes neighbors may build an adjacency table for. A table is never
+# dropped, so only the standard difficulties get one (see engine.py); a
+# custom size computes neighbors on the fly instead of pinning megabytes
+_table_sizes = set()
+
+
+def coordinate(index, y_range):
+    """:Returns: the (x, y) coordinate of a tile index"""
+    return divmod(index, y_range)
+
+
+def pack_tile(value, flip=False, flag=False):
+    """:Returns: the byte for a tile holding value (0-8 or MINE)"""
+    return value | (FLIPPED if flip else 0) | (FLAGGED if flag else 0)
+
+
+def byte_at(data, index):
+    """:Returns: the packed tile at index of an immutable board string"""
+    return ord(data[index:index + 1])
+
+
+def visible_value(byte):
+    """:Returns: what a player is allowed to see of a packed tile"""
+    if byte & FLIPPED:
+        return byte & VALUE_MASK
+    if byte & FLAGGED:
+        return FLAG_MARK
+    return HIDDEN_MARK
+
+
+VISIBLE_TABLE = bytes(bytearray(visible_value(byte) for byte in range(256)))
+
+
+def visible_values(tiles):
+    """:Returns: a bytearray of what a player sees of every tile"""
+    return bytearray(tiles).translate(VISIBLE_TABLE)
+
+
+def pack_visible(tiles):
+    """Packs the visible value of every tile into a nibble, two tiles per
+    byte with the lower index in the high nibble. An odd board is padded
+    with a trailing zero nibble.
+    :Returns: the packed board as bytes"""
+    visible = visible_values(tiles)
+    if len(visible) % 2:
+        visible.append(0)
+    return bytes(bytearray((high << 4) | low for high, low
+                           in zip(visible[0::2], visible[1::2])))
+
+
+def pack_move(tile, kind=MOVE_FLIP):
+    """:Returns: the move record for a move of kind on tile"""
+    return tile << MOVE_KIND_BITS | kind
+
+
+def unpack_move(record):
+    """:Returns: the (tile, kind) pair of a move record"""
+    return record >> MOVE_KIND_BITS, record & MOVE_KIND_MASK
+
+
+def pack_moves(records):
+    """:Returns: move records packed as little endian 32 bit integers"""
+    records = list(records)
+    return struct.pack('<{}I'.format(len(records)), *records)
+
+
+def unpack_moves(data):
+    """:Returns: the list of move records packed in data"""
+    return list(struct.unpack('<{}I'.format(len(data) // 4), data))
+
+
+def connecting_indexes(index, x_range, y_range):
+    """:Returns: a list of all adjacent indexes to a given index, computed
+    from the row-major layout of the board"""
+    x, y = divmod(index, y_range)
+    if 0 < x < x_range - 1 and 0 < y < y_range - 1:
+        above = index - y_range
+        below = index + y_range
+        return [above - 1, above, above + 1, index - 1, index + 1,
+                below - 1, below, below + 1]
+    nodes = []
+    for i in range(max(x - 1, 0), min(x + 2, x_range)):
+        row = i * y_range
+        for j in range(max(y - 1, 0), min(y + 2, y_range)):
+            if i != x or j != y:
+                nodes.append(row + j)
+    return nodes
+
+
+def adjacency(x_range, y_range):
+    """:Returns: a tuple holding the neighbors of every tile on an
+    x_range by y_range board. Tables are built once per board size and
+    shared by every game of that size."""
+    key = (x_range, y_range)
+    table = _adjacency_tables.get(key)
+    if table is None:
+        table = tuple(tuple(connecting_indexes(i, x_range, y_range))
+                      for i in range(x_range * y_range))
+        _adjacency_tables[key] = table
+    return table
+
+
+def use_adjacency_table(x_range, y_range):
+    """Lets neighbors build and keep an adjacency table for a board size"""
+    _table_sizes.add((x_range, y_range))
+
+
+def neighbors(index, x_range, y_range):
+    """:Returns: the indexes adjacent to index. Uses the adjacency table of
+    the board size if it has one, or may have one (see use_adjacency_table),
+    arithmetic otherwise."""
+    table = _adjacency_tables.get((x_range, y_range))
+    if table is None:
+        if (x_range, y_range) not in _table_sizes:
+            return connecting_indexes(index, x_range, y_range)
+        table = adjacency(x_range, y_range)
+    return table[index]
+
+
+def flood_fill(start, x_range, y_range, is_blank, skip):
+    """Breadth-first walk outwards from a blank tile, the way a cascade
+    spreads. Every tile reached is collected; only blank tiles are expanded
+    further. Tiles for which skip(index) is true (already flipped, flagged)
+    are neither collected nor expanded. Uses an explicit queue and a visited
+    set, so it works on boards far larger than the recursion limit allows
+    and only costs memory for the tiles it reaches.
+    :Returns: the list of indexes reached, in the order they were reached"""
+    visited = set([start])
+    queue = deque([start])
+    reached = []
+    while queue:
+        tile = queue.popleft()
+        for node in neighbors(tile, x_range, y_range):
+            if node in visited:
+                continue
+            visited.add(node)
+            if skip(node):
+                continue
+            reached.append(node)
+            if is_blank(node):
+                queue.append(node)
+    return reached
+
+
+def place_mines(x_range, y_range, count, excluded=(), rng=random):
+    """Scatters count mines over a fresh board, never on an excluded tile,
+    and fills in every other tile's number. Mines are drawn with
+    rng.sample over the allowed tiles, so there are no rejected draws and
+    the cost stays linear in the board size at any density. Pass a seeded
+    random.Random as rng to get the same board every time.
+    :Returns: the board as a bytearray of packed tiles
+    :Raises: ValueError if there are more mines than allowed tiles"""
+    if x_range * y_range >= NUMPY_MIN_TILES and load_numpy() is not None:
+        return _place_mines_numpy(x_range, y_range, count, excluded, rng)
+    excluded = set(excluded)
+    candidates = [i for i in range(x_range * y_range) if i not in excluded]
+    if count > len(candidates):
+        raise ValueError('Too many mines for the board')
+    tiles = bytearray(x_range * y_range)
+    for index in rng.sample(candidates, count):
+        tiles[index] = MINE
+    count_proximities(tiles, x_range, y_range)
+    return tiles
+
+
+def move_mines(tiles, x_range, y_range, excluded, rng=random):
+    """Moves every mine sitting on an excluded tile to a random tile that is
+    neither mined nor excluded, then renumbers the tiles around the old and
+    new spots. Used to make a ready-made layout safe for the first click.
+    :Returns: the list of (old, new) index pairs that were moved
+    :Raises: ValueError if there is nowhere left to put a mine"""
+    excluded = set(excluded)
+    moved = sorted(index for index in excluded if tiles[index] == MINE)
+    if not moved:
+        return []
+    free = [i for i in range(len(tiles))
+            if tiles[i] != MINE and i not in excluded]
+    if len(moved) > len(free):
+        raise ValueError('Too many mines for the board')
+    targets = rng.sample(free, len(moved))
+    touched = set()
+    for old, new in zip(moved, targets):
+        tiles[old] = 0
+        tiles[new] = MINE
+        touched.update(neighbors(old, x_range, y_range))
+        touched.update(neighbors(new, x_range, y_range))
+        touched.add(old)
+    for index in touched:
+        if tiles[index] != MINE:
+            tiles[index] = sum(1 for node in neighbors(index, x_range, y_range)
+                               if tiles[node] == MINE)
+    return list(zip(moved, targets))
+
+
+def count_proximities(tiles, x_range, y_range):
+    """Sets the number of every non-mine tile to the count of mines around
+    it. Works a row at a time: each tile's mine count with its left and
+    right neighbors is summed first, then those sums for the rows above,
+    at and below it, so no per-tile neighbor lists are needed."""
+    mines = [1 if tile == MINE else 0 for tile in tiles]
+    across = []
+    for start in range(0, len(mines), y_range):
+        row = [0] + mines[start:start + y_range] + [0]
+        across.extend(map(sum, zip(row, row[1:], row[2:])))
+    edge = [0] * y_range
+    across = edge + across + edge
+    tiles[:] = bytearray(
+        MINE if mine else above + level + below - mine
+        for above, level, below, mine
+        in zip(across, across[y_range:], across[2 * y_range:], mines))
+
+
+def load_numpy():
+    """Imports NumPy the first time it is asked for. Games never generate a
+    board big enough to use it, so the server never loads it.
+    :Returns: the numpy module, or None if it isn't installed"""
+    global numpy, _numpy_tried
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy
+        except ImportError:
+            pass
+    return numpy
+
+
+def _place_mines_numpy(x_range, y_range, count, excluded, rng):
+    """place_mines for big boards. The mines come from a NumPy RandomState
+    seeded from rng, and every tile's number is the sum of the mine mask
+    shifted in each of the eight directions."""
+    excluded = numpy.array(sorted(set(excluded)), dtype=numpy.int64)
+    allowed = x_range * y_range - len(excluded)
+    if count > allowed:
+        raise ValueError('Too many mines for the board')
+    state = numpy.random.RandomState(rng.getrandbits(32))
+    picks = state.permutation(allowed)[:count]
+    if len(excluded):
+        # Map positions among the allowed tiles back to board indexes
+        picks += numpy.searchsorted(excluded - numpy.arange(len(excluded)),
+                                    picks, side='right')
+    mines = numpy.zeros(x_range * y_range, dtype=numpy.uint8)
+    mines[picks] = 1
+    mines = mines.reshape(x_range, y_range)
+    padded = numpy.zeros((x_range + 2, y_range + 2), dtype=numpy.uint8)
+    padded[1:-1, 1:-1] = mines
+    counts = numpy.zeros((x_range, y_range), dtype=numpy.uint8)
+    for dx in (0, 1, 2):
+        for dy in (0, 1, 2):
+            if dx != 1 or dy != 1:
+                counts += padded[dx:dx + x_range, dy:dy + y_range]
+    counts[mines == 1] = MINE
+    return bytearray(numpy.ascontiguousarray(counts).data)
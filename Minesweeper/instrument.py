@@ -0,0 +1,190 @@
+"""instrument.py - Sampled instrumentation of the hot paths. A traced call
+records its wall and CPU time, the datastore and memcache RPCs made while it
+ran with the bytes each carried, and the encoded size of any message it
+returns. Whether to measure is decided once per top level call, at the
+sample rate; calls made inside a measured call are measured with it, and
+calls made inside an unmeasured one are not, without drawing again. An
+unmeasured call only costs a random() and a few thread-local lookups.
+
+Each measured call is logged as a JSON line, and added to per name totals
+in memcache that get_stats reads back. The sample rate is kept in memcache
+too (see set_sample_rate), so it changes on every instance within
+SAMPLE_RATE_SECONDS."""
+
+import functools
+import json
+import logging
+import random
+import threading
+import time
+import timeit
+
+from protorpc import messages, protojson
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import quota
+
+# Share of top level calls measured until set_sample_rate is called
+DEFAULT_SAMPLE_RATE = 0.01
+# How long an instance keeps the sample rate it last read
+SAMPLE_RATE_SECONDS = 60
+MEMCACHE_SAMPLE_RATE = 'INSTRUMENT_SAMPLE_RATE'
+MEMCACHE_STATS = 'INSTRUMENT_'
+
+# What is summed per name. Times are in microseconds; CPU time is 0 where
+# the runtime doesn't report it
+FIELDS = ('calls', 'wall_us', 'cpu_us', 'datastore_rpcs', 'datastore_bytes',
+          'memcache_rpcs', 'memcache_bytes', 'response_bytes')
+# The RPC services counted, by the field prefix they are counted under
+SERVICES = {'datastore_v3': 'datastore', 'memcache': 'memcache'}
+
+# Every traced name, registered when the decorator is applied
+_names = set()
+_local = threading.local()
+_sample_rate = DEFAULT_SAMPLE_RATE
+_sample_rate_read = None
+
+
+def traced(name):
+    """Decorator that measures a sample of the calls to a function and
+    records them under name"""
+    def decorator(func):
+        _names.add(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            spans = _spans()
+            if not spans:
+                if _local.skipping:
+                    return func(*args, **kwargs)
+                if random.random() >= sample_rate():
+                    _local.skipping = True
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        _local.skipping = False
+            span = dict.fromkeys(FIELDS, 0)
+            span['name'] = name
+            span['calls'] = 1
+            spans.append(span)
+            began = timeit.default_timer()
+            cpu = _cpu_us()
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                span['wall_us'] = int((timeit.default_timer() - began) * 1e6)
+                span['cpu_us'] = _cpu_us() - cpu
+                spans.pop()
+                if isinstance(result, messages.Message):
+                    try:
+                        span['response_bytes'] = len(
+                            protojson.encode_message(result))
+                    except messages.ValidationError:
+                        pass
+                _local.finished.append(span)
+                if not spans:
+                    finished, _local.finished = _local.finished, []
+                    _record(finished)
+        return wrapper
+    return decorator
+
+
+def sample_rate():
+    """:Returns: the share of top level calls to measure, read from
+    memcache at most once every SAMPLE_RATE_SECONDS"""
+    global _sample_rate, _sample_rate_read
+    now = time.time()
+    if _sample_rate_read is None or (
+            now - _sample_rate_read >= SAMPLE_RATE_SECONDS):
+        rate = memcache.get(MEMCACHE_SAMPLE_RATE)
+        _sample_rate = DEFAULT_SAMPLE_RATE if rate is None else rate
+        _sample_rate_read = now
+    return _sample_rate
+
+
+def set_sample_rate(rate):
+    """Sets the share of top level calls measured on every instance
+    :Raises: ValueError unless rate is between 0 and 1"""
+    global _sample_rate, _sample_rate_read
+    if not 0 <= rate <= 1:
+        raise ValueError('Sample rate must be between 0 and 1')
+    memcache.set(MEMCACHE_SAMPLE_RATE, rate)
+    _sample_rate = rate
+    _sample_rate_read = time.time()
+
+
+def get_stats():
+    """:Returns: a {name: {field: total}} dict for every traced name that
+    has been measured since the totals were last reset, read with one
+    get_multi"""
+    keys = _stat_keys()
+    totals = memcache.get_multi(keys, key_prefix=MEMCACHE_STATS)
+    stats = {}
+    for name in _names:
+        if totals.get(_stat_key(name, 'calls')):
+            stats[name] = dict((field, totals.get(_stat_key(name, field), 0))
+                               for field in FIELDS)
+    return stats
+
+
+def reset_stats():
+    """Drops the totals of every traced name"""
+    memcache.delete_multi(_stat_keys(), key_prefix=MEMCACHE_STATS)
+
+
+def _stat_key(name, field):
+    return '{}:{}'.format(name, field)
+
+
+def _stat_keys():
+    return [_stat_key(name, field) for name in sorted(_names)
+            for field in FIELDS]
+
+
+def _spans():
+    """:Returns: this thread's stack of calls being measured. skipping is
+    set on the thread while a top level call that wasn't sampled runs"""
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        spans = _local.spans = []
+        _local.finished = []
+        _local.skipping = False
+    return spans
+
+
+def _cpu_us():
+    return int(quota.megacycles_to_cpu_seconds(
+        quota.get_request_cpu_usage()) * 1e6)
+
+
+def _count_rpc(service, call, request, response):
+    """Post-call hook adding an RPC, and the bytes sent and received, to
+    every call being measured on this thread"""
+    spans = getattr(_local, 'spans', None)
+    prefix = SERVICES.get(service)
+    if not spans or prefix is None:
+        return
+    size = request.ByteSize() + response.ByteSize()
+    for span in spans:
+        span[prefix + '_rpcs'] += 1
+        span[prefix + '_bytes'] += size
+
+
+def _record(spans):
+    """Logs the measured calls of one top level call and adds them to the
+    totals with a single offset_multi. Runs once nothing is being measured,
+    so its own RPC isn't counted"""
+    totals = {}
+    for span in spans:
+        logging.info('instrument %s', json.dumps(span, sort_keys=True))
+        for field in FIELDS:
+            key = _stat_key(span['name'], field)
+            totals[key] = totals.get(key, 0) + span[field]
+    memcache.offset_multi(totals, key_prefix=MEMCACHE_STATS,
+                          initial_value=0)
+
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrument', _count_rpc)
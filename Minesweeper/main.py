@@ -3,25 +3,65 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 import logging
+from datetime import datetime, timedelta
 
 import webapp2
-from google.appengine.api import mail, app_identity
+from google.appengine.api import mail, app_identity, memcache, taskqueue
+from google.appengine.ext import ndb
 from api import MineSweeperApi
 
-from models import User
+import board_pool
+import game_session
+from models import User, Game, Score, Reminder, BOARD_SIZES,\
+    MEMCACHE_RANKINGS, user_names
+from utils import get_cursor
+
+BACKFILL_BATCH_SIZE = 200
+REMINDER_BATCH_SIZE = 100
+# A little under the cron interval, so a late batch never makes a User
+# miss the next run
+REMINDER_GAP = timedelta(hours=11)
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with unfinished games to come play
-        . Called every hour using a cron job"""
+        """Send a reminder email to each User with unfinished games to come
+        play. Called every 12 hours using a cron job; the first batch is
+        sent here and the rest by the tasks it queues."""
+        self.post()
+
+    def post(self):
+        """Remind one batch of Users with unfinished games, then queue the
+        next batch. A distinct projection query returns each player's key
+        once without loading any game, the Users and their Reminders are
+        fetched with one get_multi, and anyone reminded within REMINDER_GAP
+        is skipped."""
         app_id = app_identity.get_application_id()
-        games = Game.query(Game.game_over == False)
+        user_keys, cursor, more = Game.query(
+            Game.game_over == False, projection=[Game.user],
+            distinct=True).fetch_page(
+                REMINDER_BATCH_SIZE,
+                start_cursor=get_cursor(self.request.get('cursor')))
+        # Queue the next batch first so batches are sent side by side
+        if more and cursor:
+            taskqueue.add(url='/crons/send_reminder',
+                          params={'cursor': cursor.urlsafe()})
+        user_keys = list(set(game.user for game in user_keys))
+        now = datetime.now()
+        entities = ndb.get_multi(
+            user_keys + [Reminder.key_for(key) for key in user_keys])
         users = []
-        for game in games:
-            user = User.query(User.name == game.user)
-            if user.email:
-                users.append(user)
+        reminders = []
+        for user, reminder, key in zip(entities, entities[len(user_keys):],
+                                       user_keys):
+            if not user or not user.email or (
+                    reminder and now - reminder.sent < REMINDER_GAP):
+                continue
+            users.append(user)
+            reminders.append(Reminder(key=Reminder.key_for(key), sent=now))
+        # Recorded before sending, so a retried batch never emails twice.
+        # Only the Reminders are written, never the Users
+        ndb.put_multi(reminders)
 
         for user in users:
             subject = 'This is a reminder!'
@@ -32,6 +72,7 @@ class SendReminderEmail(webapp2.RequestHandler):
                            user.email,
                            subject,
                            body)
+        self.response.set_status(204)
 
 
 class UpdateAverageTilesRemaining(webapp2.RequestHandler):
@@ -41,7 +82,96 @@ class UpdateAverageTilesRemaining(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class RecountActiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Recount the running totals of active games and recache the
+        average. Called daily by cron to correct any drift."""
+        MineSweeperApi._recount_active_games()
+        MineSweeperApi._cache_average_tiles()
+
+
+class FillBoardPool(webapp2.RequestHandler):
+    def get(self):
+        """Top up the board pool of every difficulty. Called by cron so the
+        pools recover after memcache evicts them."""
+        for difficulty in BOARD_SIZES:
+            board_pool.fill(difficulty)
+
+    def post(self):
+        """Top up the board pool of one difficulty. Queued by new_game when
+        the pool runs low."""
+        board_pool.fill(int(self.request.get('difficulty')))
+        self.response.set_status(204)
+
+
+class FlushGameSession(webapp2.RequestHandler):
+    def post(self):
+        """Write a cached game with unflushed moves to the datastore. Queued
+        by a game session when it first falls behind the datastore."""
+        game_session.flush(self.request.get('urlsafe_game_key'))
+        self.response.set_status(204)
+
+
+class BackfillWinPercentage(webapp2.RequestHandler):
+    def get(self):
+        """Start the backfill. Visit once after deploying stored
+        win_percentage."""
+        self.post()
+
+    def post(self):
+        """Store win_percentage on a batch of Users saved before it was a
+        stored property, then queue the next batch."""
+        users, cursor, more = User.query().fetch_page(
+            BACKFILL_BATCH_SIZE,
+            start_cursor=get_cursor(self.request.get('cursor')))
+        for user in users:
+            user.update_win_percentage()
+        ndb.put_multi(users)
+        memcache.delete(MEMCACHE_RANKINGS)
+        if more and cursor:
+            taskqueue.add(url='/tasks/backfill_win_percentage',
+                          params={'cursor': cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class BackfillUserNames(webapp2.RequestHandler):
+    BATCH_KINDS = [Score, Game]
+
+    def get(self):
+        """Start the backfill. Visit once after deploying user_name on Score
+        and Game."""
+        self.post()
+
+    def post(self):
+        """Copy the User's name onto a batch of Scores or Games stored
+        before user_name was kept on them, then queue the next batch.
+        Scores are done first, then Games."""
+        kind_index = int(self.request.get('kind') or 0)
+        model = self.BATCH_KINDS[kind_index]
+        entities, cursor, more = model.query().fetch_page(
+            BACKFILL_BATCH_SIZE,
+            start_cursor=get_cursor(self.request.get('cursor')))
+        entities = [entity for entity in entities if not entity.user_name]
+        names = user_names(entities)
+        for entity in entities:
+            entity.user_name = names.get(entity.user)
+        ndb.put_multi(entities)
+        if more and cursor:
+            taskqueue.add(url='/tasks/backfill_user_names',
+                          params={'kind': kind_index,
+                                  'cursor': cursor.urlsafe()})
+        elif kind_index + 1 < len(self.BATCH_KINDS):
+            taskqueue.add(url='/tasks/backfill_user_names',
+                          params={'kind': kind_index + 1})
+        self.response.set_status(204)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
     ('/tasks/cache_average_tiles', UpdateAverageTilesRemaining),
+    ('/crons/recount_active_games', RecountActiveGames),
+    ('/tasks/fill_board_pool', FillBoardPool),
+    ('/tasks/flush_game_session', FlushGameSession),
+    ('/tasks/backfill_win_percentage', BackfillWinPercentage),
+    ('/tasks/backfill_user_names', BackfillUserNames),
 ], debug=True)
@@ -2,10 +2,50 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
-import random
 from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+import chunks
+import counters
+import engine
+import grid
+import instrument
+from engine import BOARD_SIZES
+
+BOARD_FORMATS = ('repr', 'packed', 'ints')
+MEMCACHE_RANKINGS = 'USER_RANKINGS'
+RANKINGS_PAGE_SIZE = 10
+# The cached first page of the rankings is dropped after this long even if
+# invalidate_rankings missed a change, e.g. one made by another instance
+# between its get and the set
+RANKINGS_CACHE_SECONDS = 60
+# Pending moves are written out as a MoveLog page, with a board snapshot,
+# by the first flush after this many have piled up on the Game
+MOVES_PER_PAGE = 100
+# Games on a custom board size have this difficulty
+CUSTOM_DIFFICULTY = 0
+MAX_CUSTOM_TILES = 1 << 24
+# Custom boards with at least this many tiles are stored as BoardChunks
+CHUNKED_MIN_TILES = 1 << 16
+# Chunked boards need at least one mine per this many tiles. Sparser boards
+# have blank regions that join up across the board, so one flip could
+# cascade over every chunk; at this density the largest cascade on a board
+# of MAX_CUSTOM_TILES spans a couple of thousand tiles
+CHUNKED_TILES_PER_MINE = 7
+
+
+def user_names(entities):
+    """Returns a dict mapping user keys to names for the entities that were
+    stored before user_name was kept on them, fetched with a single
+    get_multi. Empty, with no RPC, once every entity carries its name"""
+    keys = list(set(entity.user for entity in entities
+                    if not entity.user_name))
+    if not keys:
+        return {}
+    return dict((key, user.name)
+                for key, user in zip(keys, ndb.get_multi(keys)) if user)
 
 
 class User(ndb.Model):
@@ -14,38 +54,90 @@ class User(ndb.Model):
     email =ndb.StringProperty()
     wins = ndb.IntegerProperty(default=0)
     total_played = ndb.IntegerProperty(default=0)
-
-    @property
-    def win_percentage(self):
-        if self.total_played > 0:
-            return float(self.wins)/float(self.total_played)
-        else:
-            return 0
+    # Stored so rankings can be ordered by the datastore. Left unset until
+    # the first finished game, which keeps new users out of the rankings.
+    win_percentage = ndb.FloatProperty()
 
     def to_form(self):
         return UserForm(name=self.name,
                         email=self.email,
                         wins=self.wins,
                         total_played=self.total_played,
-                        win_percentage=self.win_percentage)
+                        win_percentage=self.win_percentage or 0.0)
 
-    def add_win(self):
-        """Add a win"""
-        self.wins += 1
+    def record_result(self, won):
+        """Counts a finished game without storing the User. Whoever stores
+        it calls invalidate_rankings afterwards"""
+        if won:
+            self.wins += 1
         self.total_played += 1
-        self.put()
+        self.update_win_percentage()
 
-    def add_loss(self):
-        """Add a loss"""
-        self.total_played += 1
-        self.put()
+    def update_win_percentage(self):
+        if self.total_played > 0:
+            self.win_percentage = float(self.wins)/float(self.total_played)
+
+    @classmethod
+    def ranked(cls):
+        """Returns a query for every User who has finished a game, best win
+        percentage first"""
+        return cls.query(cls.win_percentage >= 0.0).order(
+            -cls.win_percentage)
+
+    @classmethod
+    def ranked_page(cls, page_size, cursor=None):
+        """Returns a page of the rankings as (users, next_cursor), where
+        next_cursor is a urlsafe cursor string or None on the last page"""
+        users, next_cursor, more = cls.ranked().fetch_page(
+            page_size, start_cursor=cursor)
+        return users, next_cursor.urlsafe() if more and next_cursor else None
+
+    @classmethod
+    def top_ranked(cls):
+        """Returns the first page of the rankings like ranked_page, read
+        from memcache when it holds a copy at most RANKINGS_CACHE_SECONDS
+        old"""
+        page = memcache.get(MEMCACHE_RANKINGS)
+        if page is None:
+            page = cls.ranked_page(RANKINGS_PAGE_SIZE)
+            memcache.set(MEMCACHE_RANKINGS, page, time=RANKINGS_CACHE_SECONDS)
+        return page
+
+    @classmethod
+    def invalidate_rankings(cls, user):
+        """Drops the cached first page of the rankings if user is on it or
+        has just climbed onto it"""
+        page = memcache.get(MEMCACHE_RANKINGS)
+        if page is None:
+            return
+        users = page[0]
+        if (len(users) < RANKINGS_PAGE_SIZE or
+                user.key in [ranked.key for ranked in users] or
+                user.win_percentage >= users[-1].win_percentage):
+            memcache.delete(MEMCACHE_RANKINGS)
+
+
+class Reminder(ndb.Model):
+    """When the reminder cron last emailed a user, with the User's id. Kept
+    apart from the User so the cron never writes over a result stored while
+    a batch is sent"""
+    sent = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, user_key.id())
 
 class Game(ndb.Model):
     """Game object"""
 
     x_range = ndb.IntegerProperty(required=True)
-    stack = ndb.PickleProperty(required=True)
-    stack_index = ndb.PickleProperty(required=True, indexed=True)
+    board = ndb.BlobProperty()
+    # Pickled list of tile dicts, only present on games stored before the
+    # packed board. Read by migrate_stack and never written again.
+    stack = ndb.PickleProperty()
+    # Coordinates are derived from the tile index (see coordinates). Older
+    # games still carry this list; it is read but cleared on the next put().
+    stack_index = ndb.PickleProperty()
     difficulty = ndb.IntegerProperty(required=True)
     y_range = ndb.IntegerProperty(required=True)
     num_of_bombs = ndb.IntegerProperty(required=True)
@@ -54,200 +146,551 @@ class Game(ndb.Model):
     win = ndb.BooleanProperty(required=True, default=False)
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty()
     first_move = ndb.BooleanProperty(required=True, default=True)
+    # Pickled list of move dicts, only present on games stored before the
+    # move log. Packed into moves by migrate_history on the next put().
     history = ndb.PickleProperty()
+    # Moves made so far, and the packed records (see grid.pack_move) of
+    # those not yet written to a MoveLog page
+    move_count = ndb.IntegerProperty(default=0, indexed=False)
+    moves = ndb.BlobProperty(default='')
+    version = ndb.IntegerProperty(default=0)
+    seed = ndb.IntegerProperty()
+    # tiles_remaining as last added to the running totals of active games
+    # (see active_count_deltas). None once the game has left the totals, or
+    # if it was started before they existed.
+    counted_tiles = ndb.IntegerProperty(indexed=False)
+    # Set on big custom boards, which are kept in BoardChunks under the game
+    # instead of board. first_tile is the first tile flipped, the one tile
+    # their layout keeps clear of mines.
+    chunked = ndb.BooleanProperty(default=False, indexed=False)
+    first_tile = ndb.IntegerProperty(indexed=False)
 
     @classmethod
-    def new_game(cls, user, difficulty):
-        DIFFICULTIES = [1, 2, 3]
-        """Creates and returns a new game"""
-        if difficulty not in DIFFICULTIES:
+    def new_game(cls, user, difficulty, layout=None, user_name=None,
+                 size=None):
+        """Creates and returns a new game. layout is an optional (seed,
+        board) pair claimed from the board pool; its mines are moved off the
+        first tile flipped, and no form shows the board until then.
+        user_name is kept on the game, and on its score, so forms never have
+        to look the User up. size is an (x_range, y_range, num_of_bombs)
+        triple for a custom board, which overrides difficulty"""
+        if size:
+            check_custom_size(*size)
+            difficulty = CUSTOM_DIFFICULTY
+        elif difficulty not in BOARD_SIZES:
             raise ValueError('Invalid difficulty')
 
         game = Game(user=user,
+                    user_name=user_name,
                     difficulty=difficulty)
-
-        if difficulty==1:
-            game.x_range = 8
-            game.y_range = 8
-            game.num_of_bombs = 10
-
-        elif difficulty==2:
-            game.x_range = 16
-            game.y_range = 16
-            game.num_of_bombs = 40
-
-        elif difficulty == 3:
-            game.x_range = 16
-            game.y_range = 31
-            game.num_of_bombs = 99
+        game.x_range, game.y_range, game.num_of_bombs = (
+            size or BOARD_SIZES[difficulty])
 
         game.flags_remaining = game.num_of_bombs
         game.tiles_remaining = (game.x_range*game.y_range)-game.num_of_bombs
-        game.stack = []
-        game.stack_index = []
-        game.history = []
-        for i in range(game.x_range):
-            for j in range(game.y_range):
-                game.stack.append({'coordinate': (i, j),'value': 0,
-                                    'flip': False, 'flag': False})
-        for i in range(len(game.stack)):
-            game.stack_index.append(game.stack[i]['coordinate'])
+        game.counted_tiles = game.tiles_remaining
+        if game.x_range*game.y_range >= CHUNKED_MIN_TILES:
+            game.chunked = True
+        elif layout:
+            game.seed, game.board = layout
+        else:
+            game.board = bytes(bytearray(game.x_range*game.y_range))
         game.put()
         return game
 
-    def to_form(self, message=None):
-        """Returns a GameForm representation of the Game"""
+    @instrument.traced('Game.to_form')
+    def to_form(self, message=None, board_format='repr', user_name=None):
+        """Returns a GameForm representation of the Game. board_format picks
+        how the board is sent: 'repr' fills stack and stack_index with the
+        original Python repr, 'packed' fills packed_board with one nibble per
+        tile and 'ints' fills board with one integer per tile. The last two
+        only carry what the player can see (see MoveResultForm for values).
+        Pass user_name when it is already known to save a User lookup.
+        Before the first move every tile is hidden, so the board, which may
+        be a pooled layout that already holds its mines, isn't read"""
+        if board_format not in BOARD_FORMATS:
+            raise ValueError('Invalid board format')
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = (self.user_name or user_name or
+                          self.user.get().name)
         form.tiles_remaining = self.tiles_remaining
         form.flag_remaining = self.flags_remaining
         form.num_of_bombs = self.num_of_bombs
         form.game_over = self.game_over
-        form.stack = str(self.stack)
-        form.stack_index = str(self.stack_index)
+        if self.chunked:
+            # Too big to send whole; clients read it with get_board_chunk
+            form.chunk_rows = chunks.CHUNK_ROWS
+            form.chunk_columns = chunks.CHUNK_COLUMNS
+        else:
+            tiles = (bytearray(self.x_range*self.y_range) if self.first_move
+                     else self.tiles())
+            if board_format == 'repr':
+                form.stack = str(self.stack_dicts(tiles))
+                form.stack_index = str(self.coordinates())
+            elif board_format == 'packed':
+                form.packed_board = grid.pack_visible(tiles)
+            else:
+                form.board = list(grid.visible_values(tiles))
         form.message = message
         form.difficulty = self.difficulty
+        form.version = self.version
+        form.x_range = self.x_range
+        form.y_range = self.y_range
         return form
 
-    def generate_stack_index(self):
-        """indexes the coordinates so their index is searchable"""
-        for i in range(len(self.stack)):
-            self.stack_index.append(self.stack[i]['coordinate'])
-
-    def end_game(self, won=False):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
-        self.game_over = True
-        self.put()
-        # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), won=won,
-                      guesses=self.attempts_allowed - self.attempts_remaining)
-        score.put()
-
-    def add_bombs(self, protected_tile):
-        """adds bombs into the stack, making sure not place one on the
-        protected_tile
-        """
-        bomb_list =[]
-        count = self.num_of_bombs
-
-        while count > 0:
-            index = random.randint(0, len(self.stack)-1)
-            if not(self.stack[index]['value'] == 'bomb' or index == protected_tile):
-                self.stack[index]['value'] = 'bomb'
-                count -= 1
-                bomb_list.append(index)
-        self.add_bomb_proximities(bomb_list)
-
-    def add_bomb_proximities(self, bomb_list):
-        """surrounds bombs with proximity numbers"""
-        for bomb in bomb_list:
-            nodes = self.find_connecting_indexes(bomb)
-            for node in nodes:
-                value = self.stack[node]['value']
-                if value == 'bomb':
-                    continue
-                else:
-                    self.stack[node]['value'] += 1
+    @instrument.traced('Game.to_move_form')
+    def to_move_form(self, changed, message=None):
+        """Returns a MoveResultForm carrying only the tiles a move changed"""
+        tiles = self.tiles()
+        return MoveResultForm(urlsafe_key=self.key.urlsafe(),
+                              version=self.version,
+                              tiles=changed,
+                              values=[grid.visible_value(tiles[tile])
+                                      for tile in changed],
+                              tiles_remaining=self.tiles_remaining,
+                              flag_remaining=self.flags_remaining,
+                              game_over=self.game_over,
+                              win=self.win,
+                              message=message)
+
+    def coordinates(self):
+        """:Returns: the coordinate of every tile, in index order"""
+        return [grid.coordinate(i, self.y_range)
+                for i in range(self.x_range*self.y_range)]
+
+    def _pre_put_hook(self):
+        self.stack_index = None
+        if self.history is not None:
+            self.migrate_history()
+
+    def active_count_deltas(self, removed=False):
+        """Returns the {counter: delta} changes that bring the running
+        totals of active games up to date with this game, and marks them as
+        counted. A game that is over, or removed, leaves the totals.
+        Games started before the totals existed were never counted and
+        return no changes"""
+        if self.counted_tiles is None:
+            return {}
+        if self.game_over or removed:
+            deltas = {counters.ACTIVE_GAMES: -1,
+                      counters.ACTIVE_TILES_REMAINING: -self.counted_tiles}
+            self.counted_tiles = None
+        else:
+            deltas = {counters.ACTIVE_TILES_REMAINING:
+                      self.tiles_remaining - self.counted_tiles}
+            self.counted_tiles = self.tiles_remaining
+        return dict((name, delta) for name, delta in deltas.items() if delta)
+
+    def migrate_history(self):
+        """Packs the move history of a game stored before the move log into
+        pending moves. The pickled history is cleared"""
+        self.moves = grid.pack_moves(
+            grid.pack_move(move['tile'],
+                           grid.MOVE_FLAG if move['flag'] else grid.MOVE_FLIP)
+            for move in self.history)
+        self.move_count = len(self.history)
+        self.history = None
+
+    def migrate_stack(self):
+        """Converts the pickled stack of a game stored before the packed
+        board existed. The stack is cleared so the next put() only writes
+        the board."""
+        tiles = bytearray(len(self.stack))
+        for i, tile in enumerate(self.stack):
+            value = grid.MINE if tile['value'] == 'bomb' else tile['value']
+            tiles[i] = grid.pack_tile(value, tile['flip'], tile['flag'])
+        self.board = bytes(tiles)
+        self.stack = None
+
+    def tiles(self):
+        """:Returns: a mutable bytearray copy of the packed board. Callers
+        that change it store it back with self.board = bytes(tiles).
+        A chunked game returns its ChunkedBoard, the game's own board
+        rather than a copy; only index it"""
+        if self.chunked:
+            return self.chunked_board()
+        if self.board is None:
+            self.migrate_stack()
+        return bytearray(self.board)
+
+    def tile_byte(self, tile):
+        """:Returns: the packed byte of a single tile"""
+        if self.chunked:
+            return self.chunked_board()[tile]
+        if self.board is None:
+            self.migrate_stack()
+        return grid.byte_at(self.board, tile)
+
+    def tile_value(self, tile):
+        """:Returns: the number of bombs around a tile, or 'bomb'"""
+        value = self.tile_byte(tile) & grid.VALUE_MASK
+        return 'bomb' if value == grid.MINE else value
+
+    def is_flipped(self, tile):
+        return bool(self.tile_byte(tile) & grid.FLIPPED)
+
+    def is_flagged(self, tile):
+        return bool(self.tile_byte(tile) & grid.FLAGGED)
+
+    def stack_dicts(self, tiles=None):
+        """:Returns: the board, or tiles if given, in the list of tile dicts
+        format clients have always received. Only flipped tiles carry their
+        value; the rest carry the flagged or hidden mark of
+        grid.visible_value, so mines never leave the server before they are
+        flipped"""
+        return [{'coordinate': grid.coordinate(i, self.y_range),
+                 'value': ('bomb' if byte & grid.VALUE_MASK == grid.MINE
+                           else byte & grid.VALUE_MASK)
+                          if byte & grid.FLIPPED else grid.visible_value(byte),
+                 'flip': bool(byte & grid.FLIPPED),
+                 'flag': bool(byte & grid.FLAGGED)}
+                for i, byte in enumerate(self.tiles()
+                                         if tiles is None else tiles)]
+
+    def chunked_board(self):
+        """:Returns: the chunks.ChunkedBoard of a chunked game. A chunk is
+        read from its BoardChunk, or laid out from the seed if it was never
+        stored, the first time one of its tiles is used. The same board is
+        returned for the life of the instance"""
+        board = getattr(self, '_chunked_board', None)
+        if board is None:
+            key = self.key
+
+            def load(chunk):
+                stored = BoardChunk.get_by_id(chunk + 1, parent=key)
+                return stored.tiles if stored else None
+            board = chunks.ChunkedBoard(self.x_range, self.y_range,
+                                        self.num_of_bombs, seed=self.seed,
+                                        protected=self.first_tile,
+                                        loader=load if key else None)
+            self._chunked_board = board
+        return board
+
+    def take_chunks(self):
+        """:Returns: BoardChunks for the chunks of a chunked game changed
+        since the last call, to be written with the game"""
+        if not self.chunked:
+            return []
+        return [BoardChunk(parent=self.key, id=chunk + 1, tiles=data)
+                for chunk, data in self.chunked_board().take_dirty().items()]
+
+    def chunk_form(self, chunk):
+        """Returns a BoardChunkForm with what the player can see of one
+        chunk of a chunked game
+        :Raises: ValueError if the game isn't chunked or has no such
+        chunk"""
+        if not self.chunked:
+            raise ValueError('Game board is not chunked')
+        board = self.chunked_board()
+        if not 0 <= chunk < board.num_chunks:
+            raise ValueError('Invalid chunk')
+        x, y, rows, columns = board.bounds(chunk)
+        return BoardChunkForm(urlsafe_key=self.key.urlsafe(),
+                              version=self.version, chunk=chunk, x=x, y=y,
+                              rows=rows, columns=columns,
+                              packed_board=grid.pack_visible(
+                                  board.chunk_tiles(chunk)))
+
+    def to_engine(self, seed=None):
+        """:Returns: an engine.Engine playing on a copy of the game's board,
+        or on the board itself for a chunked game.
+        seed lays out a board that has no seed yet"""
+        tiles = None
+        if self.chunked:
+            tiles = self.chunked_board()
+        elif self.seed is not None or not self.first_move:
+            tiles = self.tiles()
+        return engine.Engine(self.x_range, self.y_range, self.num_of_bombs,
+                             seed=self.seed if seed is None else seed,
+                             tiles=tiles, first_move=self.first_move,
+                             flags_remaining=self.flags_remaining,
+                             tiles_remaining=self.tiles_remaining,
+                             game_over=self.game_over, win=self.win)
+
+    def from_engine(self, state):
+        """Copies the board and counts of an engine.Engine onto the game"""
+        if self.chunked:
+            self._chunked_board = state.tiles
+            self.first_tile = state.tiles.protected
+        else:
+            self.board = bytes(state.tiles)
+        self.seed = state.seed
+        self.first_move = state.first_move
+        self.flags_remaining = state.flags_remaining
+        self.tiles_remaining = state.tiles_remaining
+        self.game_over = state.game_over
+        self.win = state.win
 
     def find_connecting_indexes(self, index):
         """:Returns: a list of all adjacent indexes to a given index"""
-        nodes = []
-        x = self.stack_index[index][0]
-        y = self.stack_index[index][1]
-
-        for i in range(x-1, x+2):
-            for j in range(y-1, y+2):
-                if (i == x and j == y):
-                    continue
-                else:
-                    try:
-                        ad_index = self.stack_index.index((i,j))
-                        nodes.append(ad_index)
-                    except:
-                        continue
-        return nodes
+        return list(grid.neighbors(index, self.x_range, self.y_range))
 
+    @instrument.traced('Game.arm')
+    def arm(self, state, tile):
+        """Lays the mines of an engine.Engine made by to_engine out for a
+        first move on tile (see engine.Engine.arm). Kept apart from the flip
+        so it is traced on its own: it builds or fixes up the whole board"""
+        state.arm(tile)
+
+    @instrument.traced('Game.flip_tile')
     def flip_tile(self, tile, flag=False):
         """If flag = true, marks tile as flagged. Otherwise, flips tile
-        and cascade flips blank tiles, ends the game if tile is a mine. Checks
-        win state before concluding"""
-        selected_tile = self.stack[tile]
-
-        if flag == True:
-            if self.flags_remaining == 0:
-                raise ValueError("No flags left")
-            else:
-                selected_tile['flag']=True
-                self.flags_remaining -= 1
-
-        else:
-            if selected_tile['flag'] == True:
-                selected_tile['flag'] == False
-                self.flags_remaining += 1
-
-            else:
-                self.stack[tile]['flip'] = True
-                self.tiles_remaining -= 1
-                if selected_tile['value'] == 'bomb':
-                    self.end_game()
-                elif selected_tile['value'] == 0:
-                    self.blank_tile_cascade(tile)
-                self.check_win()
-
-    def blank_tile_cascade(self, tile):
-        """Checks all surrounding nodes for 0 value, and flips them.
-        Recursively checks each new empty node.
-        """
-        nodes = self.find_connecting_indexes(tile)
-        for node in nodes:
-            if self.stack[node]['value'] != 0:
-                self.stack[node]['flip'] = True
-                continue
-            else:
-                if not self.stack[node]['flip']:
-                    self.stack[node]['flip'] = True
-                    self.tiles_remaining -= 1
-                    self.blank_tile_cascade(node)
-
-    def check_win(self):
-        """checks win state"""
-        if self.tiles_remaining == self.num_of_bombs:
-            self.win = True
-            self.end_game()
-
-    def end_game(self):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
-        self.game_over = True
-        self.put()
-        # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), won=self.win,
+        and cascade flips blank tiles, arming the board on the first move.
+        The rules are engine.Engine's. Nothing is stored; a move that ends
+        the game is finished with end_game_async.
+        :Returns: the indexes of every tile the move changed
+        :Raises: ValueError if flag is set and no flags are left"""
+        state = self.to_engine()
+        if state.first_move and not flag:
+            self.arm(state, tile)
+        changed = state.flag(tile) if flag else state.reveal(tile)
+        self.from_engine(state)
+        return changed
+
+    @instrument.traced('Game.chord')
+    def chord(self, tile):
+        """Flips every unflagged neighbor of a flipped number, cascading
+        over blank tiles, once as many of its neighbors are flagged as it
+        says (see engine.Engine.chord). A wrong flag loses the game.
+        :Returns: the indexes of every tile the move changed"""
+        state = self.to_engine()
+        changed = state.chord(tile)
+        self.from_engine(state)
+        return changed
+
+    @ndb.tasklet
+    def end_game_async(self):
+        """Readies a game a move has just ended to be stored: reads the
+        player's User and counts the result on it, and builds the game's
+        Score. Nothing is written here: the caller writes the User and
+        Score once the move is stored (see GameSession.save), so a retried
+        move never counts twice. The Score shares the game's id.
+        :Returns: a future for the (user, score) pair"""
+        user = yield self.user.get_async()
+        user.record_result(self.win)
+        score = Score(id=self.key.id(), user=self.user,
+                      user_name=self.user_name or user.name,
+                      date=date.today(), won=self.win,
                       tiles_remaining=self.tiles_remaining,
                       difficulty=self.difficulty)
-        score.put()
+        raise ndb.Return((user, score))
+
+    def add_to_game_history(self, tile, flag=False, chord=False):
+        """Records a move as pending until the next flush writes it to the
+        move log"""
+        if self.history is not None:
+            self.migrate_history()
+        if chord:
+            kind = grid.MOVE_CHORD
+        else:
+            kind = grid.MOVE_FLAG if flag else grid.MOVE_FLIP
+        self.moves += grid.pack_moves([grid.pack_move(tile, kind)])
+        self.move_count += 1
+
+    def take_move_page(self):
+        """Once MOVES_PER_PAGE moves are pending, moves them into a MoveLog
+        page with a snapshot of the board, which must be written with the
+        game. Chunked boards are too big to snapshot, so their pages only
+        hold the moves.
+        :Returns: the page, or None"""
+        if len(self.moves) // 4 < MOVES_PER_PAGE:
+            return None
+        page = MoveLog(parent=self.key, id=self.move_count,
+                       moves=self.moves, board=self.board or '',
+                       tiles_remaining=self.tiles_remaining,
+                       flags_remaining=self.flags_remaining,
+                       win=self.win, game_over=self.game_over)
+        self.moves = ''
+        return page
+
+    def move_pages(self):
+        """:Returns: the ids of the game's MoveLog pages in order, from a
+        keys only ancestor query"""
+        return sorted(key.id() for key in
+                      MoveLog.query(ancestor=self.key).fetch(keys_only=True))
+
+    def read_moves(self, start, stop, pages=None):
+        """:Returns: the records of moves start (counting from 0) up to
+        stop, read from the move log pages that hold them and the pending
+        moves. pages is the result of move_pages, if already known"""
+        if self.history is not None:
+            self.migrate_history()
+        stop = min(stop, self.move_count)
+        if start >= stop:
+            return []
+        if pages is None:
+            pages = self.move_pages()
+        bounds = [(first, last) for first, last in zip([0] + pages, pages)
+                  if first < stop and last > start]
+        records = []
+        for (first, last), page in zip(bounds, ndb.get_multi(
+                [ndb.Key(MoveLog, last, parent=self.key)
+                 for first, last in bounds])):
+            records.extend(grid.unpack_moves(page.moves)[
+                max(start - first, 0):stop - first])
+        logged = self.move_count - len(self.moves) // 4
+        if stop > logged:
+            records.extend(grid.unpack_moves(self.moves)[
+                max(start - logged, 0):stop - logged])
+        return records
+
+    def replay(self, move_number):
+        """Rebuilds the game as it stood after its first move_number moves.
+        Starts from the last MoveLog snapshot taken by then, or from the
+        board the seed lays out, and plays the remaining moves.
+        :Returns: an unsaved Game
+        :Raises: ValueError if the game has moves but no seed to replay
+        them from"""
+        if self.history is not None:
+            self.migrate_history()
+        move_number = max(0, min(move_number, self.move_count))
+        if self.seed is None and move_number:
+            raise ValueError('Game has no seed to replay')
+        pages = self.move_pages()
+        snapshots = [page for page in pages
+                     if page <= move_number and not self.chunked]
+        if snapshots:
+            snapshot = MoveLog.get_by_id(snapshots[-1], parent=self.key)
+            state = engine.Engine(self.x_range, self.y_range,
+                                  self.num_of_bombs, seed=self.seed,
+                                  tiles=bytearray(snapshot.board),
+                                  first_move=False,
+                                  flags_remaining=snapshot.flags_remaining,
+                                  tiles_remaining=snapshot.tiles_remaining,
+                                  game_over=snapshot.game_over,
+                                  win=snapshot.win)
+            played = snapshot.key.id()
+        else:
+            tiles = None
+            if self.chunked:
+                tiles = chunks.ChunkedBoard(self.x_range, self.y_range,
+                                            self.num_of_bombs)
+            state = engine.Engine(self.x_range, self.y_range,
+                                  self.num_of_bombs, seed=self.seed,
+                                  tiles=tiles)
+            played = 0
+        for record in self.read_moves(played, move_number, pages):
+            state.play(record)
+        game = Game(key=self.key, user=self.user, user_name=self.user_name,
+                    difficulty=self.difficulty, x_range=self.x_range,
+                    y_range=self.y_range, num_of_bombs=self.num_of_bombs,
+                    version=self.version, move_count=move_number,
+                    chunked=self.chunked)
+        game.from_engine(state)
+        return game
+
+    def journal(self):
+        """:Returns: a MoveJournal of the game's pending moves"""
+        return MoveJournal(parent=self.key, id=1, move_count=self.move_count,
+                           moves=self.moves, seed=self.seed)
+
+    def catch_up(self, journal):
+        """Plays the moves a MoveJournal holds beyond the game's own. The
+        journal's moves run up to its move_count, so they cover the game's
+        as long as it hasn't taken a MoveLog page since; an older journal
+        only holds moves the game already has.
+        :Returns: the number of moves played"""
+        if self.history is not None:
+            self.migrate_history()
+        start = journal.move_count - len(journal.moves) // 4
+        if (self.chunked or self.game_over or
+                not start <= self.move_count < journal.move_count):
+            return 0
+        records = grid.unpack_moves(journal.moves)[self.move_count - start:]
+        state = self.to_engine(journal.seed)
+        for record in records:
+            state.play(record)
+        self.from_engine(state)
+        self.moves += grid.pack_moves(records)
+        self.move_count += len(records)
+        self.version += len(records)
+        return len(records)
+
+    def to_move_forms(self, start, records):
+        """Returns MoveForms for move records numbered from start. Flipped
+        tiles carry their value; a flag never reveals what it covers"""
+        tiles = self.tiles()
+        forms = []
+        for number, record in enumerate(records, start):
+            tile, kind = grid.unpack_move(record)
+            x, y = grid.coordinate(tile, self.y_range)
+            form = MoveForm(move=number, tile=tile, x=x, y=y,
+                            flag=kind == grid.MOVE_FLAG,
+                            chord=kind == grid.MOVE_CHORD)
+            if not form.flag and tiles[tile] & grid.FLIPPED:
+                form.value = tiles[tile] & grid.VALUE_MASK
+            forms.append(form)
+        return forms
+
+
+class MoveLog(ndb.Model):
+    """A page of a game's moves, stored under the Game with the number of
+    moves made by its end as id. The board and counts are a snapshot taken
+    after its last move, so replays never start further back than a page.
+    Pages of chunked games have an empty board"""
+    moves = ndb.BlobProperty(required=True)
+    board = ndb.BlobProperty(required=True)
+    tiles_remaining = ndb.IntegerProperty(indexed=False)
+    flags_remaining = ndb.IntegerProperty(indexed=False)
+    win = ndb.BooleanProperty(indexed=False)
+    game_over = ndb.BooleanProperty(indexed=False)
+
+
+class MoveJournal(ndb.Model):
+    """The pending moves of a game whose session is ahead of the Game
+    entity, stored under the Game with id 1 after every move that isn't
+    flushed. moves are the game's pending records as of move_count, so a
+    game read back after memcache evicted its session can play the ones
+    the entity is missing (see Game.catch_up). seed is kept because the
+    first move draws it"""
+    move_count = ndb.IntegerProperty(indexed=False)
+    moves = ndb.BlobProperty(required=True)
+    seed = ndb.IntegerProperty(indexed=False)
+
+
+class BoardChunk(ndb.Model):
+    """One chunk of a chunked game's board (see chunks.py), stored under
+    the Game once a move changes it. The id is the chunk index plus one,
+    since ids can't be 0"""
+    tiles = ndb.BlobProperty(required=True)
+
+
+def check_custom_size(x_range, y_range, num_of_bombs):
+    """:Raises: ValueError unless x_range by y_range is a board of at most
+    MAX_CUSTOM_TILES tiles and num_of_bombs is between 1 and half of
+    them, and at least one per CHUNKED_TILES_PER_MINE tiles if the board
+    is chunked"""
+    if x_range < 1 or y_range < 1 or x_range * y_range < 2:
+        raise ValueError('The board must have at least two tiles')
+    if x_range * y_range > MAX_CUSTOM_TILES:
+        raise ValueError('The board can have at most {} tiles'.format(
+            MAX_CUSTOM_TILES))
+    if not 1 <= num_of_bombs <= x_range * y_range // 2:
+        raise ValueError('Mines must be between 1 and half the tiles')
+    if (x_range * y_range >= CHUNKED_MIN_TILES and
+            num_of_bombs * CHUNKED_TILES_PER_MINE < x_range * y_range):
+        raise ValueError('Boards of {} tiles or more need at least one mine '
+                         'per {} tiles'.format(CHUNKED_MIN_TILES,
+                                               CHUNKED_TILES_PER_MINE))
 
-    def add_to_game_history(self, tile, flag=False):
-        """adds move to game history"""
-        move = {
-        'tile': tile,
-        'flag':flag,
-        'coordinate': self.stack[tile]['coordinate'],
-        'value': self.stack[tile]['value']}
-        self.history.append(move)
 
 class Score(ndb.Model):
     """Score object"""
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty()
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     tiles_remaining = ndb.IntegerProperty(required=True)
     difficulty = ndb.IntegerProperty(required=True)
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name,
+    def to_form(self, user_name=None):
+        """Returns a ScoreForm. Pass user_name when it is already known
+        (see user_names) to save a User lookup"""
+        return ScoreForm(user_name=(self.user_name or user_name or
+                                    self.user.get().name),
                          won=self.won,
                          date=str(self.date),
                          tiles_remaining=self.tiles_remaining,
@@ -263,24 +706,125 @@ class GameForm(messages.Message):
     game_over = messages.BooleanField(5, required=True)
     message = messages.StringField(6)
     user_name = messages.StringField(7, required=True)
-    stack = messages.StringField(8, required=True)
-    stack_index = messages.StringField(9, required=True)
+    stack = messages.StringField(8)
+    stack_index = messages.StringField(9)
     difficulty = messages.IntegerField(10)
+    version = messages.IntegerField(11)
+    packed_board = messages.BytesField(12)
+    board = messages.IntegerField(13, repeated=True)
+    x_range = messages.IntegerField(14)
+    y_range = messages.IntegerField(15)
+    chunk_rows = messages.IntegerField(16)
+    chunk_columns = messages.IntegerField(17)
+
+
+class BoardChunkForm(messages.Message):
+    """What the player can see of one chunk of a chunked board: rows by
+    columns tiles from coordinate (x, y), packed two to a byte like
+    GameForm.packed_board"""
+    urlsafe_key = messages.StringField(1, required=True)
+    version = messages.IntegerField(2, required=True)
+    chunk = messages.IntegerField(3, required=True)
+    x = messages.IntegerField(4, required=True)
+    y = messages.IntegerField(5, required=True)
+    rows = messages.IntegerField(6, required=True)
+    columns = messages.IntegerField(7, required=True)
+    packed_board = messages.BytesField(8, required=True)
+
+class MoveForm(messages.Message):
+    """One move of a game's history"""
+    move = messages.IntegerField(1, required=True)
+    tile = messages.IntegerField(2, required=True)
+    x = messages.IntegerField(3, required=True)
+    y = messages.IntegerField(4, required=True)
+    flag = messages.BooleanField(5, required=True)
+    value = messages.IntegerField(6)
+    chord = messages.BooleanField(7, default=False)
+
+
+class MoveForms(messages.Message):
+    """A page of a game's moves"""
+    items = messages.MessageField(MoveForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
 
 class GameForms(messages.Message):
     """Container for multiple GameForm"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 class NewGameForm(messages.Message):
-    """Used to create a new game"""
+    """Used to create a new game. width, height and mines, given together,
+    make a custom board instead of one of the difficulties"""
     user_name = messages.StringField(1, required=True)
     difficulty = messages.IntegerField(2, default=1)
+    width = messages.IntegerField(3)
+    height = messages.IntegerField(4)
+    mines = messages.IntegerField(5)
 
 
 class MakeMoveForm(messages.Message):
-    """Used to make a move in an existing game"""
+    """Used to make a move in an existing game. chord flips the neighbors
+    of the numbered tile instead"""
     tile = messages.IntegerField(1, required=True)
     flag = messages.BooleanField(2, default=False)
+    chord = messages.BooleanField(3, default=False)
+
+
+class MakeMovesForm(messages.Message):
+    """Used to make several moves, in order, in one request"""
+    moves = messages.MessageField(MakeMoveForm, 1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Outbound result of a move. tiles lists the changed tile indexes and
+    values what each now shows: 0-8 once flipped, 9 for a mine, 10 flagged,
+    11 hidden. version goes up by one per move, so a client that sees a gap
+    has missed an update and should fetch the game again."""
+    urlsafe_key = messages.StringField(1, required=True)
+    version = messages.IntegerField(2, required=True)
+    tiles = messages.IntegerField(3, repeated=True)
+    values = messages.IntegerField(4, repeated=True)
+    tiles_remaining = messages.IntegerField(5, required=True)
+    flag_remaining = messages.IntegerField(6, required=True)
+    game_over = messages.BooleanField(7, required=True)
+    win = messages.BooleanField(8, required=True)
+    message = messages.StringField(9)
+
+
+class GameStatsForm(messages.Message):
+    """Totals for one difficulty over every game played"""
+    difficulty = messages.IntegerField(1, required=True)
+    games_started = messages.IntegerField(2, required=True)
+    games_won = messages.IntegerField(3, required=True)
+    games_lost = messages.IntegerField(4, required=True)
+    average_tiles_remaining = messages.FloatField(5)
+
+
+class GameStatsForms(messages.Message):
+    """Container for the GameStatsForm of every difficulty"""
+    items = messages.MessageField(GameStatsForm, 1, repeated=True)
+
+
+class InstrumentStatForm(messages.Message):
+    """Averages per measured call of one traced function (see
+    instrument.py). Bytes are those sent and received by the RPCs"""
+    name = messages.StringField(1, required=True)
+    calls = messages.IntegerField(2, required=True)
+    wall_ms = messages.FloatField(3, required=True)
+    cpu_ms = messages.FloatField(4, required=True)
+    datastore_rpcs = messages.FloatField(5, required=True)
+    datastore_bytes = messages.FloatField(6, required=True)
+    memcache_rpcs = messages.FloatField(7, required=True)
+    memcache_bytes = messages.FloatField(8, required=True)
+    response_bytes = messages.FloatField(9, required=True)
+
+
+class InstrumentStatForms(messages.Message):
+    """The InstrumentStatForm of every traced function measured so far,
+    with the share of calls being measured"""
+    items = messages.MessageField(InstrumentStatForm, 1, repeated=True)
+    sample_rate = messages.FloatField(2, required=True)
 
 
 class ScoreForm(messages.Message):
@@ -294,6 +838,7 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
@@ -312,3 +857,4 @@ class UserForm(messages.Message):
 class UserForms(messages.Message):
     """Container for multiple User Forms"""
     items = messages.MessageField(UserForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""simulate.py - Self-play simulator. Plays seeded games with the solver in
+solver.py across a process pool, streams one JSON line per game and prints
+win rates, cascade sizes and move latency percentiles per difficulty. Game
+i is played from seed --seed + i, so a run's outcomes are reproducible and
+can be compared between engine changes; only the timings vary.
+
+Usage: python simulate.py [--games N] [--difficulty 1 2 3] [--processes P]
+                          [--seed S] [--batch B] [--out results.jsonl]"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import multiprocessing
+import sys
+import timeit
+
+import engine
+import solver
+
+# Histogram buckets per power of ten
+BUCKETS_PER_DECADE = 20
+
+
+class Histogram(object):
+    """Counts values in log scale buckets, so percentiles over millions of
+    values take constant memory. Percentiles are accurate to a bucket,
+    about 12%"""
+    __slots__ = ('buckets', 'count', 'total', 'largest')
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.largest = 0.0
+
+    def add(self, value):
+        bucket = (int(math.floor(math.log10(value) * BUCKETS_PER_DECADE))
+                  if value > 0 else None)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.largest = max(self.largest, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else float('nan')
+
+    def percentile(self, percent):
+        """:Returns: the upper bound of the bucket holding the percentile"""
+        if not self.count:
+            return float('nan')
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets,
+                             key=lambda b: float('-inf') if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return 0.0
+                return min(10 ** ((bucket + 1.0) / BUCKETS_PER_DECADE),
+                           self.largest)
+        return self.largest
+
+
+def play_game(difficulty, seed):
+    """Plays one game with the solver.
+    :Returns: a (result, move_us, cascades) triple: the per game result
+    dict, the engine time of every move in microseconds and the number of
+    tiles every move changed"""
+    x_range, y_range, num_of_bombs = engine.BOARD_SIZES[difficulty]
+    state = engine.Engine(x_range, y_range, num_of_bombs, seed=seed)
+    player = solver.Solver(state)
+    timer = timeit.default_timer
+    move_us = []
+    cascades = []
+    guesses = 0
+    solve_us = 0.0
+    while not state.game_over:
+        began = timer()
+        records, guessed = player.next_moves()
+        solve_us += (timer() - began) * 1e6
+        guesses += guessed
+        progress = False
+        for record in records:
+            began = timer()
+            changed = state.play(record)
+            move_us.append((timer() - began) * 1e6)
+            if changed:
+                progress = True
+                cascades.append(len(changed))
+                player.update(changed)
+            if state.game_over:
+                break
+        if not progress:
+            raise RuntimeError('Solver stalled on seed {}'.format(seed))
+    result = {'difficulty': difficulty, 'seed': seed, 'win': state.win,
+              'moves': len(move_us), 'guesses': guesses,
+              'largest_cascade': max(cascades),
+              'move_us': round(sum(move_us), 1),
+              'solve_us': round(solve_us, 1)}
+    return result, move_us, cascades
+
+
+def play_batch(task):
+    """Plays count games from first_seed. Runs in the pool workers"""
+    difficulty, first_seed, count = task
+    return [play_game(difficulty, seed)
+            for seed in range(first_seed, first_seed + count)]
+
+
+def batches(difficulties, games, seed, batch):
+    """Yields (difficulty, first_seed, count) tasks covering every game"""
+    for difficulty in difficulties:
+        for first in range(0, games, batch):
+            yield difficulty, seed + first, min(batch, games - first)
+
+
+class Summary(object):
+    """Running totals for one difficulty"""
+
+    def __init__(self):
+        self.games = 0
+        self.wins = 0
+        self.moves = 0
+        self.guesses = 0
+        self.move_us = Histogram()
+        self.cascades = Histogram()
+
+    def add(self, result, move_us, cascades):
+        self.games += 1
+        self.wins += result['win']
+        self.moves += result['moves']
+        self.guesses += result['guesses']
+        for value in move_us:
+            self.move_us.add(value)
+        for value in cascades:
+            self.cascades.add(value)
+
+
+def report(summaries, seconds):
+    print('{:>10} {:>9} {:>7} {:>7} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'difficulty', 'games', 'win %', 'moves', 'guesses', 'cascade',
+        'p50 us', 'p90 us', 'p99 us', 'max us'))
+    for difficulty in sorted(summaries):
+        summary = summaries[difficulty]
+        print('{:>10} {:>9} {:>7.1f} {:>7.1f} {:>7.2f} {:>8.1f} '
+              '{:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}'.format(
+                  difficulty, summary.games,
+                  100.0 * summary.wins / summary.games,
+                  float(summary.moves) / summary.games,
+                  float(summary.guesses) / summary.games,
+                  summary.cascades.mean(),
+                  summary.move_us.percentile(50),
+                  summary.move_us.percentile(90),
+                  summary.move_us.percentile(99),
+                  summary.move_us.largest))
+    games = sum(summary.games for summary in summaries.values())
+    print('{} games in {:.1f}s, {:.0f} games/s'.format(
+        games, seconds, games / seconds))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Minesweeper self-play')
+    parser.add_argument('--games', type=int, default=1000,
+                        help='games per difficulty')
+    parser.add_argument('--difficulty', type=int, nargs='+',
+                        default=sorted(engine.BOARD_SIZES),
+                        choices=sorted(engine.BOARD_SIZES))
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first game')
+    parser.add_argument('--batch', type=int, default=100,
+                        help='games per pool task')
+    parser.add_argument('--out', help="file to stream one JSON line per "
+                                      "game to, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    out = None
+    if args.out == '-':
+        out = sys.stdout
+    elif args.out:
+        out = open(args.out, 'w')
+    summaries = dict((difficulty, Summary())
+                     for difficulty in args.difficulty)
+    began = timeit.default_timer()
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        for results in pool.imap_unordered(
+                play_batch, batches(args.difficulty, args.games, args.seed,
+                                    args.batch)):
+            for result, move_us, cascades in results:
+                summaries[result['difficulty']].add(result, move_us,
+                                                    cascades)
+                if out:
+                    out.write(json.dumps(result, sort_keys=True) + '\n')
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if out and out is not sys.stdout:
+            out.close()
+    report(summaries, timeit.default_timer() - began)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,122 @@
+"""solver.py - A deterministic Minesweeper player for engine.Engine games. It
+only reads what a player could see and works by constraint propagation:
+every flipped number says how many mines hide among its hidden neighbors,
+and comparing those constraints finds tiles that are certainly safe or
+certainly mined. When nothing is certain it guesses the tile least likely
+to be a mine, breaking ties by index, so a seed always plays out the same."""
+
+import grid
+
+
+class Solver(object):
+    """Plays one engine.Engine game. Keeps the frontier, the flipped
+    numbers that still have hidden neighbors, up to date from the tiles
+    each move changed, so a turn never scans the whole board"""
+
+    def __init__(self, state):
+        self.state = state
+        self.frontier = set()
+
+    def update(self, changed):
+        """Brings the frontier up to date after a move changed tiles"""
+        state = self.state
+        tiles = state.tiles
+        touched = set(changed)
+        for tile in changed:
+            touched.update(grid.neighbors(tile, state.x_range,
+                                          state.y_range))
+        for tile in touched:
+            byte = tiles[tile]
+            if (byte & grid.FLIPPED and
+                    0 < byte & grid.VALUE_MASK < grid.MINE and
+                    any(not tiles[node] & (grid.FLIPPED | grid.FLAGGED)
+                        for node in grid.neighbors(tile, state.x_range,
+                                                   state.y_range))):
+                self.frontier.add(tile)
+            else:
+                self.frontier.discard(tile)
+
+    def constraints(self):
+        """:Returns: a (tile, hidden, mines) triple for every frontier
+        number, in tile order, where mines is how many of the hidden set
+        are mines once its flagged neighbors are accounted for"""
+        state = self.state
+        tiles = state.tiles
+        found = []
+        for tile in sorted(self.frontier):
+            hidden = []
+            flagged = 0
+            for node in grid.neighbors(tile, state.x_range, state.y_range):
+                if tiles[node] & grid.FLAGGED:
+                    flagged += 1
+                elif not tiles[node] & grid.FLIPPED:
+                    hidden.append(node)
+            found.append((tile, frozenset(hidden),
+                          (tiles[tile] & grid.VALUE_MASK) - flagged))
+        return found
+
+    def next_moves(self):
+        """Works out the next moves from the visible board. Satisfied
+        numbers are chorded and certain mines flagged; failing that,
+        constraints that contain one another are compared, and failing
+        that too the safest looking tile is revealed.
+        :Returns: a (records, guessed) pair; guessed is True when the
+        single record in records is a guess"""
+        state = self.state
+        if state.first_move:
+            return [grid.pack_move(state.x_range // 2 * state.y_range +
+                                   state.y_range // 2)], True
+        found = self.constraints()
+        chords = []
+        mines = set()
+        for tile, hidden, count in found:
+            if count == 0:
+                chords.append(grid.pack_move(tile, grid.MOVE_CHORD))
+            elif count == len(hidden):
+                mines.update(hidden)
+        if chords or mines:
+            return [grid.pack_move(tile, grid.MOVE_FLAG)
+                    for tile in sorted(mines)] + chords, False
+
+        safe = set()
+        by_tile = {}
+        for constraint in found:
+            for node in constraint[1]:
+                by_tile.setdefault(node, []).append(constraint)
+        for _, smaller, smaller_count in found:
+            overlapping = set()
+            for node in smaller:
+                overlapping.update(by_tile[node])
+            for _, larger, larger_count in overlapping:
+                if not smaller < larger:
+                    continue
+                rest = larger - smaller
+                if larger_count == smaller_count:
+                    safe.update(rest)
+                elif larger_count - smaller_count == len(rest):
+                    mines.update(rest)
+        if safe or mines:
+            return ([grid.pack_move(tile, grid.MOVE_FLAG)
+                     for tile in sorted(mines)] +
+                    [grid.pack_move(tile) for tile in sorted(safe)]), False
+        return [grid.pack_move(self._safest(by_tile))], True
+
+    def _safest(self, by_tile):
+        """:Returns: the hidden tile with the lowest estimated chance of
+        being a mine. A constrained tile takes the worst estimate of its
+        constraints; any other tile the share of unflagged mines over
+        every hidden tile"""
+        state = self.state
+        hidden = [tile for tile, byte in enumerate(state.tiles)
+                  if not byte & (grid.FLIPPED | grid.FLAGGED)]
+        unconstrained = float(state.flags_remaining) / len(hidden)
+        best, best_chance = None, 2.0
+        for tile in hidden:
+            if tile in by_tile:
+                chance = max(float(count) / len(nodes)
+                             for _, nodes, count in by_tile[tile])
+            else:
+                chance = unconstrained
+            if chance < best_chance:
+                best, best_chance = tile, chance
+        return best
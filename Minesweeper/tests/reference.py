@@ -0,0 +1,93 @@
+"""reference.py - A deliberately naive Minesweeper, written straight from
+the rules with (x, y) coordinates and no packed tiles, that the tests play
+against grid.py, engine.py and chunks.py."""
+
+
+def neighbors(x, y, x_range, y_range):
+    """:Returns: the coordinates around (x, y), row by row"""
+    return [(i, j) for i in range(x - 1, x + 2) for j in range(y - 1, y + 2)
+            if (i, j) != (x, y) and 0 <= i < x_range and 0 <= j < y_range]
+
+
+def numbers(mines, x_range, y_range):
+    """:Returns: a {(x, y): value} dict of every tile, 9 for a mine"""
+    return dict(((x, y), 9 if (x, y) in mines else
+                 sum(1 for node in neighbors(x, y, x_range, y_range)
+                     if node in mines))
+                for x in range(x_range) for y in range(y_range))
+
+
+class Reference(object):
+    """A game on a board whose mines are already laid out"""
+
+    def __init__(self, x_range, y_range, mines):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.mines = set(mines)
+        self.values = numbers(self.mines, x_range, y_range)
+        self.flipped = set()
+        self.flagged = set()
+        self.lost = False
+
+    @property
+    def game_over(self):
+        return self.lost or self.win
+
+    @property
+    def win(self):
+        return not self.lost and (len(self.flipped) ==
+                                  self.x_range * self.y_range -
+                                  len(self.mines))
+
+    @property
+    def flags_remaining(self):
+        return len(self.mines) - len(self.flagged)
+
+    @property
+    def tiles_remaining(self):
+        return (self.x_range * self.y_range - len(self.mines) -
+                len(self.flipped - self.mines))
+
+    def reveal(self, tile):
+        if self.game_over or tile in self.flipped:
+            return
+        if tile in self.flagged:
+            self.flagged.remove(tile)
+            return
+        self._open([tile])
+
+    def flag(self, tile):
+        if self.game_over or tile in self.flipped or tile in self.flagged:
+            return
+        if not self.flags_remaining:
+            raise ValueError('No flags left')
+        self.flagged.add(tile)
+
+    def chord(self, tile):
+        value = self.values[tile]
+        if (self.game_over or tile not in self.flipped or
+                value in (0, 9)):
+            return
+        around = neighbors(tile[0], tile[1], self.x_range, self.y_range)
+        if sum(1 for node in around if node in self.flagged) != value:
+            return
+        self._open([node for node in around
+                    if node not in self.flipped and node not in self.flagged])
+
+    def _open(self, tiles):
+        for tile in tiles:
+            if tile in self.flipped or tile in self.flagged:
+                continue
+            self.flipped.add(tile)
+            if tile in self.mines:
+                self.lost = True
+                continue
+            stack = [tile]
+            while stack:
+                x, y = stack.pop()
+                if self.values[(x, y)]:
+                    continue
+                for node in neighbors(x, y, self.x_range, self.y_range):
+                    if node not in self.flipped and node not in self.flagged:
+                        self.flipped.add(node)
+                        stack.append(node)
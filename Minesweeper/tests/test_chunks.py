@@ -0,0 +1,110 @@
+import random
+import unittest
+
+import chunks
+import engine
+import grid
+from tests import reference
+from tests.test_engine import play_random_game
+
+# Three rows and four columns of chunks, the last of each only partly used
+X_RANGE = 2 * chunks.CHUNK_ROWS + 5
+Y_RANGE = 3 * chunks.CHUNK_COLUMNS + 9
+
+
+def whole_board(board):
+    return bytearray(board[i] for i in range(len(board)))
+
+
+class ChunkedBoardTest(unittest.TestCase):
+
+    def armed(self, num_of_bombs=2000, seed=1, protected=1000, loader=None):
+        board = chunks.ChunkedBoard(X_RANGE, Y_RANGE, num_of_bombs,
+                                    loader=loader)
+        board.arm(seed, protected)
+        return board
+
+    def test_locate_and_bounds_cover_the_board(self):
+        board = chunks.ChunkedBoard(X_RANGE, Y_RANGE, 10)
+        self.assertEqual(board.num_chunks, 12)
+        seen = set()
+        for index in range(len(board)):
+            chunk, offset = board.locate(index)
+            x, y, rows, columns = board.bounds(chunk)
+            row, column = divmod(offset, chunks.CHUNK_COLUMNS)
+            self.assertLess(row, rows)
+            self.assertLess(column, columns)
+            self.assertEqual(grid.coordinate(index, Y_RANGE),
+                             (x + row, y + column))
+            seen.add((chunk, offset))
+        self.assertEqual(len(seen), len(board))
+
+    def test_numbers_match_reference(self):
+        board = self.armed()
+        tiles = whole_board(board)
+        mines = set(grid.coordinate(i, Y_RANGE) for i, byte in
+                    enumerate(tiles) if byte == grid.MINE)
+        self.assertEqual(len(mines), 2000)
+        self.assertNotIn(grid.coordinate(1000, Y_RANGE), mines)
+        values = reference.numbers(mines, X_RANGE, Y_RANGE)
+        self.assertEqual(list(tiles),
+                         [values[grid.coordinate(i, Y_RANGE)]
+                          for i in range(len(tiles))])
+
+    def test_mines_spread_by_area(self):
+        board = self.armed(num_of_bombs=3001)
+        counts = board.mine_counts()
+        self.assertEqual(sum(counts), 3001)
+        for chunk, count in enumerate(counts):
+            _, _, rows, columns = board.bounds(chunk)
+            share = 3001.0 * rows * columns / len(board)
+            self.assertTrue(int(share) <= count <= int(share) + 1)
+
+    def test_seed_gives_the_same_board(self):
+        self.assertEqual(whole_board(self.armed(seed=2)),
+                         whole_board(self.armed(seed=2)))
+        self.assertNotEqual(whole_board(self.armed(seed=2)),
+                            whole_board(self.armed(seed=3)))
+
+    def test_changed_chunks_are_reloaded(self):
+        board = self.armed()
+        board[0] |= grid.FLIPPED
+        board[len(board) - 1] |= grid.FLAGGED
+        stored = board.take_dirty()
+        self.assertEqual(sorted(stored), [0, board.num_chunks - 1])
+        self.assertEqual(board.take_dirty(), {})
+        loaded = self.armed(loader=stored.get)
+        self.assertEqual(whole_board(loaded), whole_board(board))
+        self.assertEqual(loaded.dirty, set())
+
+    def test_chunk_tiles_drop_the_unused_part(self):
+        board = self.armed()
+        last = board.num_chunks - 1
+        _, _, rows, columns = board.bounds(last)
+        self.assertEqual((rows, columns), (5, 9))
+        tiles = board.chunk_tiles(last)
+        self.assertEqual(len(tiles), rows * columns)
+        x, y = X_RANGE - rows, Y_RANGE - columns
+        self.assertEqual(tiles[:columns],
+                         bytearray(board[x * Y_RANGE + y + j]
+                                   for j in range(columns)))
+
+    def test_too_many_mines(self):
+        board = chunks.ChunkedBoard(X_RANGE, Y_RANGE, X_RANGE * Y_RANGE)
+        board.arm(1, 0)
+        self.assertRaises(ValueError, board.mine_counts)
+
+
+class ChunkedEngineTest(unittest.TestCase):
+
+    def test_random_play_matches_reference(self):
+        rng = random.Random(4)
+        for num_of_bombs in (1500, 4000):
+            board = chunks.ChunkedBoard(X_RANGE, Y_RANGE, num_of_bombs)
+            state = engine.Engine(X_RANGE, Y_RANGE, num_of_bombs,
+                                  tiles=board)
+            play_random_game(self, state, rng, moves=40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import random
+import unittest
+
+import engine
+import grid
+from tests import reference
+
+
+def visible(state):
+    """:Returns: what the player sees of an engine's board, by coordinate"""
+    return dict((grid.coordinate(i, state.y_range),
+                 grid.visible_value(state.tiles[i]))
+                for i in range(state.x_range * state.y_range))
+
+
+def reference_visible(game):
+    """:Returns: what the player sees of a reference game, by coordinate"""
+    seen = {}
+    for tile, value in game.values.items():
+        if tile in game.flipped:
+            seen[tile] = value
+        elif tile in game.flagged:
+            seen[tile] = grid.FLAG_MARK
+        else:
+            seen[tile] = grid.HIDDEN_MARK
+    return seen
+
+
+def play_random_game(test, state, rng, moves=200):
+    """Plays random moves on an engine and a reference game laid out with
+    the mines the engine's first reveal placed, comparing them after every
+    move.
+    :Returns: the move records played"""
+    x_range, y_range = state.x_range, state.y_range
+    first = rng.randrange(x_range * y_range)
+    state.reveal(first)
+    test.assertFalse(state.first_move)
+    test.assertNotEqual(state.tiles[first] & grid.VALUE_MASK, grid.MINE)
+    mines = [grid.coordinate(i, y_range) for i in range(x_range * y_range)
+             if state.tiles[i] & grid.VALUE_MASK == grid.MINE]
+    test.assertEqual(len(mines), state.num_of_bombs)
+    game = reference.Reference(x_range, y_range, mines)
+    game.reveal(grid.coordinate(first, y_range))
+    records = [grid.pack_move(first)]
+    for _ in range(moves):
+        if state.game_over:
+            break
+        tile = rng.randrange(x_range * y_range)
+        kind = rng.choice((grid.MOVE_FLIP, grid.MOVE_FLAG, grid.MOVE_FLAG,
+                           grid.MOVE_CHORD))
+        coordinate = grid.coordinate(tile, y_range)
+        if kind == grid.MOVE_FLAG:
+            if not game.flags_remaining and coordinate not in game.flagged \
+                    and coordinate not in game.flipped:
+                test.assertRaises(ValueError, state.flag, tile)
+                test.assertRaises(ValueError, game.flag, coordinate)
+                continue
+            changed = state.flag(tile)
+            game.flag(coordinate)
+        elif kind == grid.MOVE_CHORD:
+            changed = state.chord(tile)
+            game.chord(coordinate)
+        else:
+            changed = state.reveal(tile)
+            game.reveal(coordinate)
+        records.append(grid.pack_move(tile, kind))
+        test.assertEqual(len(changed), len(set(changed)))
+        test.assertEqual(visible(state), reference_visible(game))
+        test.assertEqual(state.tiles_remaining, game.tiles_remaining)
+        test.assertEqual(state.flags_remaining, game.flags_remaining)
+        test.assertEqual(state.game_over, game.game_over)
+        test.assertEqual(state.win, game.win)
+    return records
+
+
+class EngineTest(unittest.TestCase):
+
+    def test_random_play_matches_reference(self):
+        rng = random.Random(1)
+        for _ in range(60):
+            x_range, y_range = rng.randint(2, 12), rng.randint(2, 12)
+            num_of_bombs = rng.randint(1, x_range * y_range // 3)
+            state = engine.Engine(x_range, y_range, num_of_bombs)
+            play_random_game(self, state, rng)
+
+    def test_standard_boards(self):
+        rng = random.Random(2)
+        for difficulty in sorted(engine.BOARD_SIZES):
+            for _ in range(10):
+                state = engine.Engine(*engine.BOARD_SIZES[difficulty])
+                play_random_game(self, state, rng, moves=400)
+
+    def test_replay_rebuilds_the_game(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            state = engine.Engine(9, 9, 10)
+            records = play_random_game(self, state, rng)
+            replayed = engine.replay(9, 9, 10, state.seed, records)
+            self.assertEqual(replayed.tiles, state.tiles)
+            self.assertEqual(replayed.tiles_remaining, state.tiles_remaining)
+            self.assertEqual(replayed.flags_remaining, state.flags_remaining)
+            self.assertEqual(replayed.game_over, state.game_over)
+            self.assertEqual(replayed.win, state.win)
+
+    def test_seeded_layout_is_armed_around_the_first_tile(self):
+        layout = grid.place_mines(8, 8, 10, (), random.Random(4))
+        mine = list(layout).index(grid.MINE)
+        state = engine.Engine(8, 8, 10, seed=4)
+        self.assertEqual(state.tiles, layout)
+        state.reveal(mine)
+        self.assertNotEqual(state.tiles[mine] & grid.VALUE_MASK, grid.MINE)
+        self.assertFalse(state.game_over)
+        self.assertEqual(sum(1 for byte in state.tiles
+                             if byte & grid.VALUE_MASK == grid.MINE), 10)
+
+    def test_nothing_but_a_reveal_starts_the_game(self):
+        state = engine.Engine(8, 8, 10)
+        self.assertEqual(state.flag(3), [])
+        self.assertEqual(state.chord(3), [])
+        self.assertTrue(state.first_move)
+        self.assertIsNone(state.seed)
+
+    def test_revealing_a_flag_removes_it(self):
+        state = engine.Engine(8, 8, 10, seed=5)
+        state.reveal(0)
+        hidden = next(i for i, byte in enumerate(state.tiles)
+                      if not byte & grid.FLIPPED)
+        self.assertEqual(state.flag(hidden), [hidden])
+        self.assertEqual(state.flags_remaining, 9)
+        self.assertEqual(state.reveal(hidden), [hidden])
+        self.assertFalse(state.tiles[hidden] & (grid.FLIPPED | grid.FLAGGED))
+        self.assertEqual(state.flags_remaining, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import random
+import unittest
+
+import grid
+from tests import reference
+
+SIZES = [(1, 1), (1, 7), (7, 1), (2, 2), (3, 5), (8, 8), (16, 31)]
+
+
+def mines_of(tiles):
+    return set(i for i, byte in enumerate(tiles)
+               if byte & grid.VALUE_MASK == grid.MINE)
+
+
+def expected_values(tiles, x_range, y_range):
+    """The numbers reference.numbers gives the mines of a board, in index
+    order"""
+    mines = set(grid.coordinate(i, y_range) for i in mines_of(tiles))
+    values = reference.numbers(mines, x_range, y_range)
+    return [values[grid.coordinate(i, y_range)]
+            for i in range(x_range * y_range)]
+
+
+class NeighborsTest(unittest.TestCase):
+
+    def check(self, x_range, y_range):
+        for index in range(x_range * y_range):
+            x, y = grid.coordinate(index, y_range)
+            expected = [i * y_range + j for i, j in
+                        reference.neighbors(x, y, x_range, y_range)]
+            self.assertEqual(sorted(grid.neighbors(index, x_range, y_range)),
+                             expected)
+            self.assertEqual(
+                sorted(grid.connecting_indexes(index, x_range, y_range)),
+                expected)
+
+    def test_small_boards(self):
+        for x_range, y_range in SIZES:
+            self.check(x_range, y_range)
+
+    def test_custom_size_gets_no_table(self):
+        x_range, y_range = 300, 300
+        grid.neighbors(0, x_range, y_range)
+        self.assertNotIn((x_range, y_range), grid._adjacency_tables)
+        for index in (0, 299, 300, 45150, 89700, 89999):
+            x, y = grid.coordinate(index, y_range)
+            self.assertEqual(
+                sorted(grid.neighbors(index, x_range, y_range)),
+                [i * y_range + j for i, j in
+                 reference.neighbors(x, y, x_range, y_range)])
+
+
+class PlaceMinesTest(unittest.TestCase):
+
+    def test_numbers_match_reference(self):
+        rng = random.Random(1)
+        for x_range, y_range in SIZES:
+            tiles_count = x_range * y_range
+            for count in {0, tiles_count // 5, tiles_count - 1}:
+                excluded = [rng.randrange(tiles_count)]
+                tiles = grid.place_mines(x_range, y_range, count, excluded,
+                                         rng)
+                self.assertEqual(len(tiles), tiles_count)
+                self.assertEqual(len(mines_of(tiles)), count)
+                self.assertNotIn(excluded[0], mines_of(tiles))
+                self.assertEqual(list(tiles),
+                                 expected_values(tiles, x_range, y_range))
+
+    def test_seed_gives_the_same_board(self):
+        first = grid.place_mines(16, 31, 99, (), random.Random(7))
+        second = grid.place_mines(16, 31, 99, (), random.Random(7))
+        self.assertEqual(first, second)
+
+    def test_too_many_mines(self):
+        self.assertRaises(ValueError, grid.place_mines, 3, 3, 9, [4])
+
+    @unittest.skipIf(grid.load_numpy() is None, 'NumPy is not installed')
+    def test_numpy_numbers_match_reference(self):
+        rng = random.Random(2)
+        for x_range, y_range in ((64, 64), (5, 9), (1, 40)):
+            excluded = sorted(rng.sample(range(x_range * y_range), 3))
+            tiles = grid._place_mines_numpy(x_range, y_range, 30, excluded,
+                                            rng)
+            self.assertEqual(len(mines_of(tiles)), 30)
+            self.assertFalse(mines_of(tiles) & set(excluded))
+            self.assertEqual(list(tiles),
+                             expected_values(tiles, x_range, y_range))
+
+
+class CountProximitiesTest(unittest.TestCase):
+
+    def test_matches_reference(self):
+        rng = random.Random(3)
+        for x_range, y_range in SIZES:
+            tiles = bytearray(grid.MINE if rng.random() < 0.3 else 0
+                              for _ in range(x_range * y_range))
+            grid.count_proximities(tiles, x_range, y_range)
+            self.assertEqual(list(tiles),
+                             expected_values(tiles, x_range, y_range))
+
+
+class MoveMinesTest(unittest.TestCase):
+
+    def test_clears_excluded_tiles(self):
+        rng = random.Random(4)
+        for _ in range(50):
+            tiles = grid.place_mines(8, 8, 40, (), rng)
+            excluded = rng.sample(range(64), 9)
+            grid.move_mines(tiles, 8, 8, excluded, rng)
+            self.assertEqual(len(mines_of(tiles)), 40)
+            self.assertFalse(mines_of(tiles) & set(excluded))
+            self.assertEqual(list(tiles), expected_values(tiles, 8, 8))
+
+    def test_nowhere_to_move(self):
+        tiles = grid.place_mines(2, 2, 3, (), random.Random(5))
+        self.assertRaises(ValueError, grid.move_mines, tiles, 2, 2,
+                          range(4))
+
+
+class FloodFillTest(unittest.TestCase):
+
+    def test_matches_reference_cascade(self):
+        rng = random.Random(6)
+        for _ in range(30):
+            x_range, y_range = rng.randint(1, 20), rng.randint(1, 20)
+            count = rng.randint(0, x_range * y_range // 4)
+            tiles = grid.place_mines(x_range, y_range, count, (), rng)
+            blanks = [i for i, byte in enumerate(tiles) if byte == 0]
+            if not blanks:
+                continue
+            start = rng.choice(blanks)
+            game = reference.Reference(
+                x_range, y_range,
+                [grid.coordinate(i, y_range) for i in mines_of(tiles)])
+            game.reveal(grid.coordinate(start, y_range))
+            reached = grid.flood_fill(start, x_range, y_range,
+                                      lambda node: tiles[node] == 0,
+                                      lambda node: False)
+            self.assertEqual(len(reached), len(set(reached)))
+            self.assertEqual(
+                set(grid.coordinate(i, y_range) for i in reached + [start]),
+                game.flipped)
+
+
+class PackingTest(unittest.TestCase):
+
+    def test_moves_round_trip(self):
+        records = [grid.pack_move(tile, kind) for tile, kind in
+                   ((0, grid.MOVE_FLIP), (63, grid.MOVE_FLAG),
+                    (1 << 24, grid.MOVE_CHORD))]
+        self.assertEqual(grid.unpack_moves(grid.pack_moves(records)), records)
+        self.assertEqual([grid.unpack_move(record) for record in records],
+                         [(0, grid.MOVE_FLIP), (63, grid.MOVE_FLAG),
+                          (1 << 24, grid.MOVE_CHORD)])
+
+    def test_visible_values_hide_unflipped_tiles(self):
+        tiles = bytearray([grid.pack_tile(grid.MINE),
+                           grid.pack_tile(3, flag=True),
+                           grid.pack_tile(2, flip=True),
+                           grid.pack_tile(grid.MINE, flip=True),
+                           grid.pack_tile(0)])
+        self.assertEqual(list(grid.visible_values(tiles)),
+                         [grid.HIDDEN_MARK, grid.FLAG_MARK, 2, grid.MINE,
+                          grid.HIDDEN_MARK])
+        self.assertEqual(bytearray(grid.pack_visible(tiles)),
+                         bytearray([0xba, 0x29, 0xb0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
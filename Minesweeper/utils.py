@@ -2,6 +2,7 @@
 
 import logging
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 import endpoints
 
 def get_by_urlsafe(urlsafe, model):
@@ -33,3 +34,15 @@ def get_by_urlsafe(urlsafe, model):
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
     return entity
+
+
+def get_cursor(urlsafe):
+    """Returns the query Cursor a urlsafe cursor string stands for, or None
+    if urlsafe is empty. Raises a BadRequestException if the string is not
+    a valid cursor"""
+    if not urlsafe:
+        return None
+    try:
+        return Cursor(urlsafe=urlsafe)
+    except Exception:
+        raise endpoints.BadRequestException('Invalid cursor')